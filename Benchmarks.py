@@ -0,0 +1,341 @@
+'''This script times parts of the model so that changes which make them slower are noticed.
+
+    Benchmark_Population:
+        Times building a population one person at a time with Country.Add_Person, as the scenario scripts do, against
+        building it all at once with Country.Add_Population.
+
+    Benchmark_Memory:
+        Measures the memory used per person by a normal and a compact population.
+
+    Benchmark_Scenarios:
+        Runs each of the scenario scripts (see SCENARIOS) as a seeded, headless workload, scaled up from the size in the
+        script by several orders of magnitude. Each scale multiplies the number of people, and grows the country to keep
+        the same number of people per square. For each workload it measures the startup time (building the simulation),
+        the number of iterations per second, and the peak memory. Each workload runs in a fresh process, so that the
+        peak memory of one does not hide that of the next.
+
+    Benchmark_Import:
+        Times starting a fresh Python process and importing the model in it, as every worker process of Ensemble,
+        ParameterSweep, and Decomposition does, against importing it along with matplotlib.pyplot, which the model
+        used to load whether or not anything was drawn.
+
+    Save_Baseline and Compare_Baseline:
+        Save the results of Benchmark_Scenarios to a JSON baseline file, and compare new results against one, flagging any
+        which are worse by more than a threshold.
+
+
+    Simply running this script will run every benchmark and print the results. To record a baseline, or check for
+    regressions against one, run
+
+        python Benchmarks.py --save baseline.json
+        python Benchmarks.py --compare baseline.json
+'''
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from math import sqrt
+from time import perf_counter
+import json
+import os
+import platform
+import subprocess
+import sys
+import numpy as np
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from InfectiousDisease import Country
+from ParameterSweep import Build_Simulation
+
+
+def Benchmark_Population(sizes = (10**3, 10**4, 10**5, 10**6), loop_limit = 10**5):
+    '''Time building populations of each of the given sizes in a 1000x1000 country. Building with the loop is skipped
+        for sizes above loop_limit, since it takes too long. Returns a list of (size, loop seconds, bulk seconds), with
+        None for the skipped loop timings.'''
+
+    Results = []
+
+    for size in sizes:
+        LoopTime = None
+
+        if size <= loop_limit:
+            country = Country(N = 1000, seed = 0)
+            Start = perf_counter()
+            for i in range(size):
+                country.Add_Person('S', MoveType = 'Drunkard')
+            LoopTime = perf_counter() - Start
+
+        country = Country(N = 1000, seed = 0)
+        Start = perf_counter()
+        country.Add_Population(size, 'S', MoveType = 'Drunkard')
+        BulkTime = perf_counter() - Start
+
+        Results.append((size, LoopTime, BulkTime))
+
+    return Results
+
+
+def Benchmark_Memory(N = 1000, size = 10**6):
+    '''Build a population of size people in an NxN country, both normally and compactly. Returns a list of (compact,
+        bytes per person, total bytes of the population).'''
+
+    Results = []
+
+    for compact in (False, True):
+        country = Country(N = N, seed = 0, compact = compact)
+        country.Add_Population(size, 'S', MoveType = 'Drunkard')
+
+        People = country.People
+        Results.append((compact, People.Bytes_Per_Person(), People.nbytes()))
+
+    return Results
+
+
+
+
+def Benchmark_Import(imports = None, repeats = 5):
+    '''Time starting a fresh Python process and running each of the given import statements in it, repeats times.
+        Returns a list of (statement, best seconds for the whole process, best seconds for the import alone, peak memory
+        of the process in bytes or None).'''
+
+    if imports is None:
+        imports = ['pass',
+                   'import numpy',
+                   'import InfectiousDisease',
+                   'import InfectiousDisease; import matplotlib.pyplot']
+
+    #Run from the directory of this script, so that the model can be imported
+    Here = os.path.dirname(os.path.abspath(__file__))
+    #The peak memory is found the same way as _Peak_Memory, without importing anything else which would add to it
+    Code = ('from time import perf_counter\n'
+            'Start = perf_counter()\n'
+            '{}\n'
+            'Import = perf_counter() - Start\n'
+            'Peak = None\n'
+            'try:\n'
+            '    Peak = [int(Line.split()[1])*1024 for Line in open("/proc/self/status") if Line.startswith("VmHWM:")][0]\n'
+            'except OSError:\n'
+            '    pass\n'
+            'print(Import, Peak)')
+
+    Results = []
+
+    for statement in imports:
+        Process, Import = float('inf'), float('inf')
+
+        for i in range(repeats):
+            Start = perf_counter()
+            Output = subprocess.run([sys.executable, '-c', Code.format(statement)], cwd = Here, capture_output = True,
+                                    text = True, check = True).stdout.split()
+            Process = min(Process, perf_counter() - Start)
+            Import = min(Import, float(Output[0]))
+
+        Results.append((statement, Process, Import, None if Output[1] == 'None' else int(Output[1])))
+
+    return Results
+
+
+#The configurations of the scenario scripts, in the form used by ParameterSweep.Build_Simulation
+SCENARIOS = {'WorstCaseScenario': {'N': 100,
+                                   'Population': [['S', 500, 'Random'], ['I', 1, 'Random']]},
+             'SocialDistancing': {'N': 150,
+                                  'Population': [['S', 500, 'Random'], ['I', 1, 'Random']]},
+             'SIRS': {'N': 100,
+                      'Population': [['S', 500, 'Drunkard'], ['I', 5, 'Random']],
+                      'Recovered_Iters': 125},
+             'SomeTravelers': {'N': 100,
+                               'Population': [['S', 400, 'Drunkard'], ['S', 100, 'Random'], ['I', 1, 'Drunkard']]},
+             'VeryFewTravelers': {'N': 100,
+                                  'Population': [['S', 450, 'Drunkard'], ['S', 50, 'Random'], ['I', 1, 'Drunkard']]},
+             'VeryFewTravelersWithIsolation': {'N': 100,
+                                               'Population': [['S', 225, 'Drunkard'], ['S', 225, 'Isolate'], ['S', 50, 'Random'],
+                                                              ['I', 1, 'Drunkard']]},
+             'VeryFewTravelersWithMostlyIsolation': {'N': 100,
+                                                     'Population': [['S', 50, 'Drunkard'], ['S', 400, 'Isolate'], ['S', 50, 'Random'],
+                                                                    ['I', 1, 'Drunkard']]}}
+
+
+def Scale_Config(config, scale):
+    '''Returns config with scale times as many people of each kind, in a country grown by sqrt(scale) on each side
+        so that there are about as many people per square.'''
+
+    return {**config,
+            'N': int(round(config['N']*sqrt(scale))),
+            'Population': [[State, count*scale, MoveType] for State, count, MoveType in config['Population']]}
+
+
+def _Peak_Memory():
+    #The most memory this process has ever used, in bytes, or None where it cannot be found. On Linux ru_maxrss carries
+    #over the peak of the parent process, so the high water mark of this process itself is read from /proc instead.
+    try:
+        with open('/proc/self/status') as f:
+            for Line in f:
+                if Line.startswith('VmHWM:'):
+                    return int(Line.split()[1])*1024
+    except OSError:
+        pass
+
+    if resource is None:
+        return None
+
+    Peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    #ru_maxrss is in bytes on macOS, and in kilobytes elsewhere
+    return Peak if sys.platform == 'darwin' else Peak*1024
+
+
+def Run_Workload(config, iters, seed = 0):
+    '''Build the simulation described by config with the given seed and run it for iters iterations, whether or not
+        anyone is still infected. Returns a dictionary of the startup time (seconds), the iterations per second, and the
+        peak memory of this process (bytes).'''
+
+    Start = perf_counter()
+    Sim = Build_Simulation(config, seed)
+    Startup = perf_counter() - Start
+
+    Start = perf_counter()
+    for i in range(iters):
+        Sim.Step()
+    Time = perf_counter() - Start
+
+    return {'startup': Startup,
+            'ticks_per_second': iters/Time,
+            'peak_memory': _Peak_Memory()}
+
+
+def Benchmark_Scenarios(scenarios = None, scales = (1, 10, 100, 1000), iters = 20, seed = 0):
+    '''Run each of the named scenarios (by default every one in SCENARIOS) at each scale for iters iterations, each in
+        a fresh process. Returns a dictionary from 'name@scale' to a dictionary of N, the number of people, and the
+        measurements of Run_Workload.'''
+
+    Results = {}
+    Context = get_context('spawn')
+
+    for name in (scenarios or SCENARIOS):
+        for scale in scales:
+            config = Scale_Config(SCENARIOS[name], scale)
+
+            with ProcessPoolExecutor(max_workers = 1, mp_context = Context) as Pool:
+                Result = Pool.submit(Run_Workload, config, iters, seed).result()
+
+            Results[f'{name}@{scale}'] = {'N': config['N'],
+                                         'people': sum(count for State, count, MoveType in config['Population']),
+                                         **Result}
+
+    return Results
+
+
+def Save_Baseline(path, results, iters):
+    '''Write the results of Benchmark_Scenarios, run for iters iterations, to the JSON file path along with a
+        description of the machine which produced them.'''
+
+    Baseline = {'machine': {'python': platform.python_version(),
+                            'numpy': np.__version__,
+                            'platform': platform.platform(),
+                            'processor': platform.processor(),
+                            'cpus': os.cpu_count()},
+                'iters': iters,
+                'results': results}
+
+    Temp = path + '.tmp'
+    with open(Temp, 'w') as f:
+        json.dump(Baseline, f, indent = 1)
+
+    os.replace(Temp, path)
+
+
+def Compare_Baseline(path, results, threshold = 0.20):
+    '''Compare the results of Benchmark_Scenarios against the baseline saved to the JSON file path. Returns a list of
+        (workload, measure, baseline, new, relative change) for every measurement which is worse than the baseline by
+        more than threshold (a proportion), i.e. fewer iterations per second, or more startup time or peak memory.
+        Workloads missing from either are skipped.'''
+
+    with open(path) as f:
+        Baseline = json.load(f)['results']
+
+    Regressions = []
+
+    for workload, New in results.items():
+        if workload not in Baseline:
+            continue
+
+        for measure, Sign in (('ticks_per_second', -1), ('startup', 1), ('peak_memory', 1)):
+            Old, Value = Baseline[workload][measure], New[measure]
+
+            if not Old or Value is None:
+                continue
+
+            Change = (Value - Old)/Old
+
+            if Sign*Change > threshold:
+                Regressions.append((workload, measure, Old, Value, Change))
+
+    return Regressions
+
+
+
+
+if __name__ == '__main__':
+
+    from argparse import ArgumentParser
+
+    Parser = ArgumentParser(description = 'Run the benchmarks.')
+    Parser.add_argument('--save', help = 'save the scenario results to this baseline file')
+    Parser.add_argument('--compare', help = 'compare the scenario results against this baseline file')
+    Parser.add_argument('--threshold', type = float, default = 0.20, help = 'the proportion by which a result may be worse than the baseline')
+    Parser.add_argument('--scales', type = int, nargs = '+', default = [1, 10, 100, 1000])
+    Parser.add_argument('--iters', type = int, default = 20)
+    Args = Parser.parse_args()
+
+    print('Building a population')
+    print('   people   Add_Person (s)   Add_Population (s)   speedup')
+
+    for size, LoopTime, BulkTime in Benchmark_Population(sizes = (10**3, 10**4, 10**5, 10**6, 10**7)):
+        if LoopTime is None:
+            print(f'{size:9d} {"-":>16} {BulkTime:20.4f} {"-":>9}')
+        else:
+            print(f'{size:9d} {LoopTime:16.4f} {BulkTime:20.4f} {LoopTime/BulkTime:9.0f}')
+
+    print()
+    print('Memory of a population of a million people')
+    print('  compact   bytes/person   total (MB)   100M people (GB)')
+
+    for compact, PerPerson, Total in Benchmark_Memory():
+        print(f'{str(compact):>9} {PerPerson:14d} {Total/2**20:12.1f} {PerPerson*10**8/2**30:18.2f}')
+
+    print()
+    print('Starting a process and importing the model')
+    print('import                                               process (s)   import (s)   peak (MB)')
+
+    for statement, Process, Import, Peak in Benchmark_Import():
+        Peak = '-' if Peak is None else f'{Peak/2**20:.0f}'
+        print(f'{statement:52} {Process:11.4f} {Import:12.4f} {Peak:>11}')
+
+    print()
+    print(f'Scenarios, {Args.iters} iterations each')
+    print('workload                                          N      people   startup (s)   iters/s   peak (MB)')
+
+    Results = Benchmark_Scenarios(scales = Args.scales, iters = Args.iters)
+
+    for workload, Result in Results.items():
+        Peak = '-' if Result['peak_memory'] is None else f'{Result["peak_memory"]/2**20:.0f}'
+        print(f'{workload:42} {Result["N"]:8d} {Result["people"]:11d} {Result["startup"]:13.4f} {Result["ticks_per_second"]:9.1f} {Peak:>11}')
+
+    if Args.save:
+        Save_Baseline(Args.save, Results, Args.iters)
+        print(f'Baseline saved to {Args.save}')
+
+    if Args.compare:
+        Regressions = Compare_Baseline(Args.compare, Results, Args.threshold)
+
+        print()
+        print(f'{len(Regressions)} regressions of more than {Args.threshold:.0%} against {Args.compare}')
+
+        for workload, measure, Old, Value, Change in Regressions:
+            print(f'{workload:42} {measure:16} {Old:14.4g} -> {Value:<14.4g} {Change:+.0%}')
+
+        if Regressions:
+            sys.exit(1)
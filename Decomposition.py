@@ -0,0 +1,329 @@
+'''This script runs a simulation of a very large country across several worker processes. The country is split into
+    tiles, each a band of whole rows, and each tile is owned by one worker. All of the people, and the grid of infected
+    persons, are kept in shared memory so that no worker has to copy the whole country.
+
+    Every iteration each worker:
+        1. Moves the people in its tile (using the same MoveKernels as Country.Move_People). People who leave the tile,
+           whether they stepped over the edge or jumped somewhere else entirely as a Random mover, are posted to a
+           shared outbox, and every worker picks up the people who arrived in its tile.
+        2. Counts the infected persons in its tile on the shared grid.
+        3. Reads a halo of radius rows on either side of its tile from the shared grid (wrapping around the edges of the
+           country), sums the Moore Neighborhood of every square in its tile, and updates the states of its people
+           (using the same Transition as Country.Update_People).
+
+    Each worker has its own random number stream, so the results are statistically equivalent to Simulation.Run_Headless
+    but not identical to it.
+
+    Run_Decomposed:
+        Runs a Simulation this way and returns the same time series as Simulation.Run_Headless.
+
+
+    Simply running this script will report how the run time of a large country changes with the number of workers.
+'''
+
+from multiprocessing import get_context, get_all_start_methods
+from multiprocessing.shared_memory import SharedMemory
+from threading import BrokenBarrierError
+from time import perf_counter
+import os
+import numpy as np
+
+from InfectiousDisease import Country, Simulation, Window_Sum, Transition, MoveKernels, S, I, R
+
+
+#The arrays of a Population which are shared between the workers
+_Fields = ('State', 'Row', 'Col', 'MoveType', 'Due')
+
+
+class _Shared:
+    '''A set of NumPy arrays living in one block of shared memory. Specs is a list of (name, shape, dtype). Pass
+        the block name to another process to attach to the same arrays.'''
+
+    def __init__(self, Specs, name = None):
+        self.Specs = Specs
+
+        #Round every array up to a multiple of 8 bytes so that the next one is aligned
+        Sizes = [-(-int(np.prod(Shape))*np.dtype(dtype).itemsize//8)*8 for Name, Shape, dtype in Specs]
+
+        if name is None:
+            self.Memory = SharedMemory(create = True, size = max(1, sum(Sizes)))
+        else:
+            self.Memory = SharedMemory(name = name)
+
+        Offset = 0
+        for (Name, Shape, dtype), Size in zip(Specs, Sizes):
+            setattr(self, Name, np.ndarray(Shape, dtype = dtype, buffer = self.Memory.buf, offset = Offset))
+            Offset += Size
+
+
+    def Close(self):
+        #The arrays must be dropped before the memory they point to can be closed
+        for Name, Shape, dtype in self.Specs:
+            setattr(self, Name, None)
+
+        self.Memory.close()
+
+
+
+
+def _Worker(w, Bounds, Name, Specs, Barrier, Sync, seed, t, radius, risk, Infected_Iters, Recovered_Iters):
+    '''The loop run by worker w, which owns the rows Bounds[w] to Bounds[w+1] of the country.'''
+
+    Shared = _Shared(Specs, Name)
+    rng = np.random.default_rng(seed)
+
+    try:
+        N = Shared.Grid.shape[0]
+        r0, r1 = Bounds[w], Bounds[w+1]
+        Rows = np.arange(r0 - radius, r1 + radius) % N
+
+        #The people who start in this tile
+        Owned = np.flatnonzero((Shared.Row >= r0) & (Shared.Row < r1))
+
+        while True:
+            #Wait for the go-ahead from the main process
+            Sync.wait()
+            if Shared.Command[0] == 0:
+                break
+
+            t += 1
+
+            #1. Move the people in this tile
+            for MoveType, Kernel in MoveKernels.items():
+                Movers = Owned[Shared.MoveType[Owned] == MoveType]
+
+                if len(Movers) > 0:
+                    Kernel(Shared.Row, Shared.Col, Movers, N, rng)
+
+            Stay = (Shared.Row[Owned] >= r0) & (Shared.Row[Owned] < r1)
+            Leaving = Owned[~Stay]
+            Owned = Owned[Stay]
+
+            Shared.Emigrants[w] = len(Leaving)
+            Barrier.wait()
+
+            #Post the people leaving this tile to the outbox, after those of the workers before this one
+            Start = Shared.Emigrants[:w].sum()
+            Shared.Outbox[Start:Start+len(Leaving)] = Leaving
+
+            #Clear this tile of the grid, now that every worker is done reading the previous iteration
+            Shared.Grid[r0:r1] = 0
+            Barrier.wait()
+
+            #Pick up the people who arrived in this tile
+            Arrivals = Shared.Outbox[:Shared.Emigrants.sum()]
+            Arrivals = Arrivals[(Shared.Row[Arrivals] >= r0) & (Shared.Row[Arrivals] < r1)]
+            Owned = np.concatenate([Owned, Arrivals])
+
+            #2. Count the infected persons in this tile
+            State = Shared.State[Owned]
+            pI = Owned[State == I]
+            Shared.Grid[r0:r1] = np.bincount((Shared.Row[pI].astype(np.int64) - r0)*N + Shared.Col[pI], minlength = (r1 - r0)*N).reshape(r1 - r0, N)
+            Barrier.wait()
+
+            #3. Read the halo and count the infected neighbors of every square in this tile
+            Neighbors = Window_Sum(Window_Sum(Shared.Grid[Rows], radius, wrap = False), radius)
+
+            Susceptible = Owned[State == S]
+            nI = Neighbors[Shared.Row[Susceptible].astype(np.int64) - r0, Shared.Col[Susceptible]]
+
+            #Each tile is small, so rather than keeping a Schedule the people who are due are found from Due directly
+            Due = Owned[(Shared.Due[Owned] == t) & (State != S)]
+            Recovering = Due[Shared.State[Due] == I]
+            Waning = Due[Shared.State[Due] == R]
+
+            Transition(Shared, Recovering, Waning, Susceptible, nI, risk, t, Infected_Iters, Recovered_Iters, rng)
+
+            Shared.Counts[w] = np.bincount(Shared.State[Owned], minlength = 4)
+            Sync.wait()
+
+    except BrokenBarrierError:
+        pass
+
+    except BaseException:
+        #Do not leave everyone else waiting for this worker
+        Barrier.abort()
+        Sync.abort()
+        raise
+
+    finally:
+        Shared.Close()
+
+
+
+
+def Run_Decomposed(sim, max_iters, workers = None):
+    '''Run the Simulation sim for at most max_iters iterations, until no one is infected, or until it has settled down
+        (if it has a steady_state), with its country split into workers tiles (by default one per core). Returns the same
+        dictionary of arrays as Simulation.Run_Headless, sets stop_reason and stop_iter as Simulation.Iter_Steps does,
+        and leaves the country in its final state. If the run fails or is interrupted, the country is left as it was
+        before the run.'''
+
+    country = sim.country
+
+    if country.Pool is not None:
+        raise ValueError('Run_Decomposed does not support the aggregate engine, since the Pool is not split into tiles')
+
+    if country.provenance is not None:
+        raise ValueError('Run_Decomposed does not record provenance, since the workers update the people themselves')
+
+    if country.streams is not None:
+        raise ValueError('Run_Decomposed does not support common random numbers, since each worker has a stream of its own')
+
+    People = country.People
+    N = country.N
+    nPeople = len(People)
+    workers = min(workers or os.cpu_count(), N)
+
+    #Split the rows of the country as evenly as possible
+    Bounds = np.linspace(0, N, workers + 1).astype(int)
+
+    Specs = [(Name, (nPeople,), getattr(People, Name).dtype) for Name in _Fields]
+    Specs += [('Grid', (N, N), np.int32),
+              ('Outbox', (nPeople,), np.int64),
+              ('Emigrants', (workers,), np.int64),
+              ('Counts', (workers, 4), np.int64),
+              ('Command', (1,), np.int64)]
+
+    #Decide when anyone who was just added changes state, before handing the people over to the workers
+    country.Schedule_Pending(sim.Infected_Iters, sim.Recovered_Iters)
+
+    Shared = _Shared(Specs)
+    for Name in _Fields:
+        getattr(Shared, Name)[:] = getattr(People, Name)
+
+    Context = get_context('fork') if 'fork' in get_all_start_methods() else get_context()
+    Barrier = Context.Barrier(workers)
+    Sync = Context.Barrier(workers + 1)
+
+    #Give every worker its own random number stream, drawn from the country's generator
+    Seeds = np.random.SeedSequence(country.rng.integers(2**63)).spawn(workers)
+
+    Processes = [Context.Process(target = _Worker, args = (w, Bounds, Shared.Memory.name, Specs, Barrier, Sync, Seeds[w], country.Iteration, sim.radius,
+                                                           sim.risk, sim.Infected_Iters, sim.Recovered_Iters))
+                 for w in range(workers)]
+
+    for Process in Processes:
+        Process.start()
+
+    tData = np.zeros(max_iters + 1, dtype = np.int64)
+    SIRData = np.zeros((max_iters + 1, 3), dtype = np.float32)
+    tData[0] = sim.iters
+    SIRData[0] = sim.Fractions()
+
+    sim.stop_reason = None
+    sim.stop_iter = None
+
+    Start = sim.iters
+    Finished = False
+
+    try:
+        n = 1
+        Shared.Command[0] = 1
+
+        while True:
+            #Stop for the same reasons, checked in the same order, as Simulation.Iter_Steps
+            if SIRData[n-1, 1] == 0:
+                sim.stop_reason = 'extinction'
+            elif sim.steady_state is not None and sim.steady_state.Steady():
+                sim.stop_reason = 'steady_state'
+            elif n > max_iters:
+                sim.stop_reason = 'max_iters'
+
+            if sim.stop_reason is not None:
+                sim.stop_iter = sim.iters
+                break
+
+            #Start an iteration, and wait for every worker to finish it
+            Sync.wait()
+            Sync.wait()
+
+            sim.iters += 1
+            Fractions = Shared.Counts.sum(axis = 0)[[S, I, R]]/nPeople
+            tData[n] = sim.iters
+            SIRData[n] = Fractions
+
+            if sim.steady_state is not None:
+                sim.steady_state.Add(Fractions)
+
+            n += 1
+
+        #Tell the workers to stop
+        Shared.Command[0] = 0
+        Sync.wait()
+
+        Finished = True
+
+    except BrokenBarrierError:
+        raise RuntimeError('A worker failed while running the simulation')
+
+    finally:
+        if not Finished:
+            #Whatever went wrong, possibly in this process rather than a worker, release the workers waiting on the
+            #barriers so that they stop rather than waiting forever
+            Barrier.abort()
+            Sync.abort()
+
+        for Process in Processes:
+            Process.join()
+
+        if Finished:
+            #Copy the final state of the people back into the country
+            for Name in _Fields:
+                getattr(People, Name)[:] = getattr(Shared, Name)
+
+            country.Iteration += n - 1
+            country.Recount()
+            country.Rebuild_Schedule()
+        else:
+            #The workers stopped part way through an iteration, so the country is left as it was before the run
+            sim.iters = Start
+            sim.stop_reason = None
+            sim.stop_iter = None
+
+        Shared.Close()
+        Shared.Memory.unlink()
+
+    return {'t': tData[:n],
+            'S': SIRData[:n, 0].copy(),
+            'I': SIRData[:n, 1].copy(),
+            'R': SIRData[:n, 2].copy(),
+            'HC_Exceeded': SIRData[:n, 1] > sim.hospital_capacity}
+
+
+
+
+if __name__ == '__main__':
+
+    #A large country of mostly Drunkard movers with a few travelers, as in VeryFewTravelers.py
+    N = 4000
+    Iters = 20
+
+    def Build():
+        country = Country(N = N, seed = 0)
+
+        for i in range(1440000):
+            country.Add_Person('S', MoveType = 'Drunkard')
+
+        for i in range(160000):
+            country.Add_Person('S', MoveType = 'Random')
+
+        for i in range(1000):
+            country.Add_Person('I', MoveType = 'Drunkard')
+
+        return Simulation(country, radius = 1, risk = 0.10, Infected_Iters = 100)
+
+    print(f'Strong scaling on a {N}x{N} country, {Iters} iterations ({os.cpu_count()} cores available)')
+    print('workers   seconds   speedup')
+
+    for workers in (1, 2, 4, 8, 16):
+        Sim = Build()
+
+        Start = perf_counter()
+        Run_Decomposed(Sim, Iters, workers)
+        Time = perf_counter() - Start
+
+        if workers == 1:
+            Base = Time
+
+        print(f'{workers:7d} {Time:9.2f} {Base/Time:9.2f}')
@@ -0,0 +1,178 @@
+'''This script runs many replicates of the same simulation, each with its own random numbers, across a pool of
+    processes, and summarizes the results. A single run of a stochastic scenario says very little on its own; an
+    ensemble of runs gives the spread of the epidemic curves.
+
+    Run_Ensemble:
+        Runs a scenario a given number of times using Simulation.Run_Headless. The scenario is either a Simulation,
+        in which case every replicate starts from a copy of it, or a function which takes a seed and returns a new
+        Simulation, in which case the population can be placed differently in every replicate (the function must be
+        defined at the top level of a module so it can be sent to the worker processes). Every replicate gets an
+        independent random number stream spawned from a single seed, so the whole ensemble can be repeated exactly.
+        The percentiles of the proportion Susceptible, Infected, and Recovered over the replicates are returned for
+        every iteration.
+
+    Run_Paired:
+        Runs two scenarios side by side, giving the same seed to both halves of each pair of replicates, and returns the
+        difference between them. If the scenarios use common random numbers (a Country made with common_random = True),
+        the two halves of each pair share every draw where the scenarios agree, so far fewer replicates are needed to
+        tell the scenarios apart.
+
+
+    Simply running this script will run an ensemble of the worst-case scenario and print the median epidemic curve, then
+    compare two risks with and without common random numbers.
+'''
+
+from concurrent.futures import ProcessPoolExecutor
+from copy import deepcopy
+import os
+import numpy as np
+
+from InfectiousDisease import Country, Simulation
+
+
+#The scenario and iteration limit used by a worker process, set once when the worker starts
+_Scenario = None
+_Max_Iters = None
+
+
+def _Init_Worker(scenario, max_iters):
+    global _Scenario, _Max_Iters
+
+    _Scenario = scenario
+    _Max_Iters = max_iters
+
+
+def _Run_Replicate(seed):
+    '''Run a single replicate of the scenario of this worker, with the random number stream given by seed.'''
+
+    if isinstance(_Scenario, Simulation):
+        #Start from a copy so that replicates run in this process do not see each other
+        Sim = deepcopy(_Scenario)
+        Sim.country.Seed(seed)
+    else:
+        #Place the people and run the replicate with different streams, or the first moves would repeat the placement.
+        #The children are spawned from a copy so that the other half of a pair gets the same ones
+        Place, Run = deepcopy(seed).spawn(2)
+        Sim = _Scenario(Place)
+        Sim.country.Seed(Run)
+
+    return Sim.Run_Headless(_Max_Iters)
+
+
+def _Run_Replicates(scenario, Seeds, max_iters, processes):
+    #Run one replicate of scenario per seed, and return the result of each in the same order
+    if processes == 1:
+        _Init_Worker(scenario, max_iters)
+        return [_Run_Replicate(s) for s in Seeds]
+
+    processes = processes or os.cpu_count()
+
+    #Hand out the replicates in a few chunks per worker to keep the overhead of sending them small
+    chunksize = max(1, len(Seeds)//(4*processes))
+
+    with ProcessPoolExecutor(processes, initializer = _Init_Worker, initargs = (scenario, max_iters)) as Pool:
+        return list(Pool.map(_Run_Replicate, Seeds, chunksize = chunksize))
+
+
+def Run_Ensemble(scenario, replicates, max_iters, seed = None, processes = None, percentiles = (5, 50, 95)):
+    '''Run replicates independent copies of scenario (a Simulation, or a function taking a seed and returning one)
+        for at most max_iters iterations each, spread over processes worker processes (by default one per core). If
+        processes is 1, the replicates are run in this process. seed determines the random numbers of the whole
+        ensemble.
+
+        Returns a dictionary of NumPy arrays: t holds the iterations, and S, I, and R each hold one row per entry of
+        percentiles with that percentile of the proportion in that state over the replicates. HC_Exceeded holds the
+        proportion of replicates in which the hospital capacity is exceeded, and Iters holds the number of iterations
+        each replicate ran for. Replicates which stop early (because no one is infected any more) keep their final
+        values for the remaining iterations.'''
+
+    #Spawn an independent random number stream for each replicate
+    Seeds = np.random.SeedSequence(seed).spawn(replicates)
+    Results = _Run_Replicates(scenario, Seeds, max_iters, processes)
+
+    #Line the replicates up on a common time axis
+    Iters = np.array([len(Result['t']) for Result in Results])
+    T = Iters.max()
+    t = Results[np.argmax(Iters)]['t']
+
+    Summary = {'t': t, 'percentiles': np.asarray(percentiles)}
+
+    for Key in ('S', 'I', 'R', 'HC_Exceeded'):
+        Data = np.zeros((replicates, T), dtype = np.float32)
+
+        for n, Result in enumerate(Results):
+            Data[n, :Iters[n]] = Result[Key]
+            Data[n, Iters[n]:] = Result[Key][-1]
+
+        if Key == 'HC_Exceeded':
+            Summary[Key] = Data.mean(axis = 0)
+        else:
+            Summary[Key] = np.percentile(Data, percentiles, axis = 0)
+
+    Summary['Iters'] = Iters - 1
+
+    return Summary
+
+
+def Run_Paired(scenario_a, scenario_b, replicates, max_iters, seed = None, processes = None):
+    '''Run replicates pairs of replicates of scenario_a and scenario_b (each a Simulation, or a function taking a seed and
+        returning one, as for Run_Ensemble) for at most max_iters iterations each. Both halves of each pair are given the
+        same seed. See Run_Ensemble for the rest of the arguments.
+
+        Returns a dictionary of NumPy arrays: Peak_I holds the largest proportion infected, and Final_R the proportion
+        recovered at the end, of each replicate, with one row per pair and one column per scenario. Peak_I_Difference and
+        Final_R_Difference hold the mean of the difference (scenario_b - scenario_a) over the pairs, and its standard error.'''
+
+    Seeds = np.random.SeedSequence(seed).spawn(replicates)
+    Results = [_Run_Replicates(scenario, Seeds, max_iters, processes) for scenario in (scenario_a, scenario_b)]
+
+    Summary = {'Peak_I': np.array([[Result['I'].max() for Result in Pair] for Pair in zip(*Results)]),
+               'Final_R': np.array([[Result['R'][-1] for Result in Pair] for Pair in zip(*Results)])}
+
+    for Key in ('Peak_I', 'Final_R'):
+        Difference = Summary[Key][:, 1] - Summary[Key][:, 0]
+        Summary[Key + '_Difference'] = np.array([Difference.mean(), Difference.std(ddof = 1)/np.sqrt(replicates)])
+
+    return Summary
+
+
+
+
+if __name__ == '__main__':
+
+    #The worst-case scenario
+    country = Country(N = 100)
+
+    for i in range(500):
+        country.Add_Person('S', MoveType = 'Random')
+
+    country.Add_Person('I', MoveType = 'Random')
+
+    Sim = Simulation(country, radius = 1, risk = 0.10, Infected_Iters = 100)
+
+    Summary = Run_Ensemble(Sim, replicates = 100, max_iters = 1000, seed = 0)
+
+    print('Iteration   S (median)   I (median)   R (median)')
+    for n in range(0, len(Summary['t']), 25):
+        print(f"{Summary['t'][n]:9d} {Summary['S'][1, n]:12.3f} {Summary['I'][1, n]:12.3f} {Summary['R'][1, n]:12.3f}")
+
+    #Compare a risk of 0.10 with 0.075, first with independent random numbers and then with common random numbers
+    print()
+    print('Effect of lowering the risk from 0.10 to 0.075 over 50 pairs of replicates')
+    print('                          peak infected           finally recovered')
+
+    for common_random in (False, True):
+        Pair = []
+
+        for risk in (0.10, 0.075):
+            country = Country(N = 100, seed = 0, common_random = common_random)
+            country.Add_Population(500, 'S', MoveType = 'Random')
+            country.Add_Population(1, 'I', MoveType = 'Random')
+
+            Pair.append(Simulation(country, radius = 1, risk = risk, Infected_Iters = 100))
+
+        Paired = Run_Paired(*Pair, replicates = 50, max_iters = 1000, seed = 0)
+        Label = 'common random numbers' if common_random else 'independent'
+
+        print(f"{Label:22} {Paired['Peak_I_Difference'][0]:+8.3f} +/- {Paired['Peak_I_Difference'][1]:.3f} "
+              f"{Paired['Final_R_Difference'][0]:+14.3f} +/- {Paired['Final_R_Difference'][1]:.3f}")
@@ -0,0 +1,211 @@
+'''This script turns a simulation into a video or an animated GIF without ever opening a window. Each frame is the same
+    figure Simulation.Run shows: the proportion of the population in each state over time on the left, and the country
+    of Elbonia on the right.
+
+    The simulation is first recorded with an Output.TrajectoryWriter, which only has to paint a snapshot of the country
+    now and again, so recording runs at nearly the full speed of Simulation.Run_Headless. The frames are then drawn from
+    the recorded snapshots by a pool of worker processes, each with its own matplotlib figure, while this process
+    writes them out in order.
+
+    Export_Recording:
+        Writes a video or GIF of a directory recorded by a TrajectoryWriter.
+
+    Export_Simulation:
+        Records a simulation and writes a video or GIF of it. This is what Simulation.Export does.
+
+
+    Files ending in .gif are written with Pillow (which comes with matplotlib). Anything else, e.g. .mp4, is written by
+    piping the frames to ffmpeg, which must be installed.
+
+
+    Simply running this script will export the worst-case scenario as WorstCaseScenario.gif.
+'''
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from tempfile import TemporaryDirectory
+import os
+import shutil
+import subprocess
+import numpy as np
+
+from Output import TrajectoryWriter, TrajectoryReader
+
+
+#The figure drawn by a worker process (see _Init_Renderer)
+_Renderer = None
+
+
+class _Frames:
+    '''Draws the frames of a recording, one snapshot at a time, on a figure which is reused for every frame.'''
+
+    def __init__(self, directory, hospital_capacity, dpi):
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+        from InfectiousDisease import Draw_Figure
+
+        self.Run = TrajectoryReader(directory)
+        self.Fractions = self.Run.Fractions()
+
+        self.fig = Figure(figsize = (6, 4), dpi = dpi)
+        FigureCanvasAgg(self.fig)
+
+        #The lines are filled in by Draw. The hospital capacity line is left empty if it is not known.
+        self.hospital_capacity = hospital_capacity
+        self.Artists = Draw_Figure(self.fig, self.Run.snapshots[0], [], [], [], [], [])
+
+
+    def Draw(self, k):
+        '''Returns snapshot k of the recording drawn as an RGBA image.'''
+
+        ax_Left, mat, lineS, lineI, lineR, lineHC = self.Artists
+
+        #Everything up to and including the iteration of the snapshot
+        t = self.Run.snapshot_t[k]
+        n = np.searchsorted(self.Run.t, t, side = 'right')
+        tData = self.Run.t[:n]
+
+        mat.set_data(self.Run.snapshots[k])
+        for line, Series in zip((lineS, lineI, lineR), self.Fractions):
+            line.set_data(tData, Series[:n])
+
+        if self.hospital_capacity is not None:
+            lineHC.set_data(tData, np.full(n, self.hospital_capacity))
+
+        #Update aspect ratio and xaxis limit, as Simulation.Run does
+        ax_Left.set_xlim([0, max(t, 1)])
+        ax_Left.set_aspect(max(t, 1))
+
+        self.fig.canvas.draw()
+
+        return np.array(self.fig.canvas.buffer_rgba())
+
+
+def _Init_Renderer(directory, hospital_capacity, dpi):
+    #Each worker opens the recording and builds its figure once
+    global _Renderer
+    _Renderer = _Frames(directory, hospital_capacity, dpi)
+
+
+def _Render(k):
+    return _Renderer.Draw(k)
+
+
+def _Rendered(directory, hospital_capacity, dpi, processes):
+    #Yields every frame of the recording in order. At most a few frames per worker are drawn ahead of the one being
+    #written, so the frames waiting to be written never take up much memory.
+    nFrames = len(TrajectoryReader(directory).snapshot_t)
+
+    if processes == 1:
+        Frames = _Frames(directory, hospital_capacity, dpi)
+        for k in range(nFrames):
+            yield Frames.Draw(k)
+        return
+
+    processes = processes or os.cpu_count()
+
+    with ProcessPoolExecutor(processes, initializer = _Init_Renderer, initargs = (directory, hospital_capacity, dpi)) as Pool:
+        Pending = deque()
+
+        for k in range(nFrames):
+            Pending.append(Pool.submit(_Render, k))
+
+            if len(Pending) >= 4*processes:
+                yield Pending.popleft().result()
+
+        while Pending:
+            yield Pending.popleft().result()
+
+
+def _Check_Writer(path):
+    #Make sure there is a way to write path before anything is done
+    if not path.lower().endswith('.gif') and shutil.which('ffmpeg') is None:
+        raise RuntimeError(f'ffmpeg is needed to write {path}, but it could not be found')
+
+
+def Export_Recording(directory, path, fps = 30, hospital_capacity = None, processes = None, dpi = 100):
+    '''Write a video or GIF of the recording in directory (written by a TrajectoryWriter with a snapshot_stride) to
+        the file path, at fps frames per second, with one frame per snapshot. hospital_capacity, if given, is drawn as
+        a dashed line. The frames are drawn by processes worker processes (by default one per core), or in this process
+        if processes is 1, at dpi dots per inch on a 6x4 inch figure. Returns the number of frames written.'''
+
+    nFrames = len(TrajectoryReader(directory).snapshot_t)
+
+    if nFrames == 0:
+        raise ValueError(f'{directory} has no snapshots to export')
+
+    _Check_Writer(path)
+
+    Frames = _Rendered(directory, hospital_capacity, dpi, processes)
+
+    if path.lower().endswith('.gif'):
+        from PIL import Image
+
+        #Pillow draws the rest of the frames from the generator as it writes them
+        Images = (Image.fromarray(Frame).convert('RGB') for Frame in Frames)
+        First = next(Images)
+        First.save(path, save_all = True, append_images = Images, duration = 1000/fps, loop = 0)
+
+        return nFrames
+
+    First = next(Frames)
+    Height, Width = First.shape[:2]
+
+    Command = ['ffmpeg', '-y', '-loglevel', 'error', '-f', 'rawvideo', '-pix_fmt', 'rgba', '-s', f'{Width}x{Height}',
+               '-r', str(fps), '-i', '-', '-pix_fmt', 'yuv420p', path]
+
+    with subprocess.Popen(Command, stdin = subprocess.PIPE) as ffmpeg:
+        ffmpeg.stdin.write(First.tobytes())
+
+        for Frame in Frames:
+            ffmpeg.stdin.write(Frame.tobytes())
+
+        ffmpeg.stdin.close()
+
+    if ffmpeg.returncode != 0:
+        raise RuntimeError(f'ffmpeg failed to write {path}')
+
+    return nFrames
+
+
+def Export_Simulation(sim, path, max_iters, stride = 1, fps = 30, directory = None, processes = None, dpi = 100):
+    '''Run the Simulation sim for at most max_iters iterations, or until no one is infected, and write a video or GIF of
+        it to the file path with a frame every stride iterations, and a last frame of the iteration the run stopped at.
+        The run is recorded into directory, which is kept, or into a temporary directory if it is None. See
+        Export_Recording for the rest of the arguments. Returns the number of frames written.'''
+
+    _Check_Writer(path)
+
+    with TemporaryDirectory() as Temp:
+        directory = directory or Temp
+
+        with TrajectoryWriter(directory, snapshot_stride = stride) as Writer:
+            sim.Add_Output(Writer)
+
+            try:
+                sim.Run_Headless(max_iters)
+            finally:
+                sim.outputs.remove(Writer)
+
+            #The run rarely stops on a multiple of stride, so the last frame shows where it stopped
+            Writer.Snapshot(sim)
+
+        return Export_Recording(directory, path, fps, sim.hospital_capacity, processes, dpi)
+
+
+
+
+if __name__ == '__main__':
+
+    from InfectiousDisease import Country, Simulation
+
+    #The worst-case scenario
+    country = Country(N = 100, seed = 0)
+    country.Add_Population(500, 'S', MoveType = 'Random')
+    country.Add_Population(1, 'I', MoveType = 'Random')
+
+    Sim = Simulation(country, radius = 1, risk = 0.10, Infected_Iters = 100)
+
+    n = Export_Simulation(Sim, 'WorstCaseScenario.gif', 1000, stride = 5, fps = 20)
+    print(f'Wrote {n} frames to WorstCaseScenario.gif')
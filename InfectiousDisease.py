@@ -2,20 +2,43 @@
     of an infectious disease through the ficticious country of Elbonia. Below are descriptions of
     each class.
 
-    Person:
-        Each instance of the Person class represents someone who lives in Elbonia. Each person has a location
-        (the attribute Loc) indicating the row and column where that person is currently located. Each person additionally
-        has the attribute State, indicating whether that peron is Susceptible (S), Infected (I), or Recovered (R). Finally, each
-        person has an attribute MoveType, which will be used by the method Move, which dictates how this person moves
-        around Elbonia.
+    Population:
+        An instance of the Population class holds everyone who lives in Elbonia. Rather than one object per person, the
+        population stores each attribute of the people as a NumPy array with one entry per person. Each person has a location
+        (the arrays Row and Col) indicating the row and column where that person is currently located. Each person additionally
+        has a State, indicating whether that peron is Susceptible (S), Infected (I), or Recovered (R), stored as the integer
+        codes given in StateCodes. Finally, each person has a MoveType, stored as the integer codes given in MoveTypeCodes,
+        which dictates how this person moves around Elbonia.
 
     Country:
-        Each instance of the Country class represents a country as a 2-D Grid of size NxN. A country consists of a population of
-        citizens which can be added to the country using the method Add_Person. The method Move_People moves each person in
+        Each instance of the Country class represents a country as a 2-D Grid of size NxN. A country consists of a Population of
+        citizens which can be added to the country one at a time using the method Add_Person, or many at a time using the method
+        Add_Population. The method Move_People moves each person in
         the country according to that persons MoveType, and the method Update_People updates the people in the population,
         where a susceptible person can become sick, an infected person can recover, and a recovered person can become
         susceptible again. These updates all happen according to parameters which can be tweaked - see the Simulation class
-        below for more details.
+        below for more details. The attribute profiler times each phase of these updates (see Profiling.py), and the
+        attribute provenance, if set, records who infected whom (see Provenance.py). The methods Emigrate and Immigrate
+        move people from one country to another (see Metapopulation.py).
+
+    CommonRandom:
+        Counter-based random numbers, with a stream for each person and each purpose (placing, moving, and infecting
+        them) which does not depend on anyone else. A country made with common_random = True draws from these, so that
+        two scenarios run with the same seed only differ where their configurations do. The RandomPool and Sampled
+        durations still draw from the random number generator of the country.
+
+    RandomPool:
+        A RandomPool holds Random movers as the number of people in each state rather than one by one. Since a Random mover
+        jumps to a random square every iteration, everyone in the same state is interchangeable, so only the number of
+        susceptible people, and the number of infected and recovered people due to change state on each iteration, are kept.
+        Country.Aggregate_Random moves a country's Random movers into its Pool.
+
+    SteadyState:
+        Tells when the proportion of the population in each state has settled down, so that a run which will never reach
+        zero infected persons, such as an SIRS model, can stop once nothing more is happening.
+
+    StepView:
+        A read-only view of a simulation after one of the iterations of Simulation.Iter_Steps.
 
     Simulation:
         Each simulation class consists of a country and a set of attributes which define the how the disease spreads. The attribute
@@ -23,10 +46,18 @@
         neighbors and possibly become infected. The attribute risk is a real number in (0, 1] which indicates the risk of becoming infected per
         infected person in your neighborhood. The attribute Infected_Iters is a positive integer indicating the number of iterations required
         for an infected person to become recovered. The attribute Recovered_Iters is similarly the number of iterations required for a recovered
-        person to become susceptible again. Finally the attribute hospital_capacity is a real number in [0. 1] which indicates the proportion of
+        person to become susceptible again. Either of these can instead be Sampled, so that the number of iterations is drawn at random
+        for each person. Finally the attribute hospital_capacity is a real number in [0. 1] which indicates the proportion of
         the population which can be serviced by Elbonias healthcare system without being overrun.
 
-        The method Run, runs the simulation with the given parameters.
+        The method Run, runs the simulation with the given parameters. Run steps the simulation on a thread of its own and
+        only draws the latest iteration, so it runs as fast as the model rather than as fast as the figure can be drawn.
+        The method Run_Headless runs the simulation without plotting anything, and returns the proportion of the population
+        in each state over time. The method Iter_Steps steps through the simulation one iteration at a time, yielding a
+        StepView of the counts and the grid which copies neither. The methods Save_Checkpoint and Load_Checkpoint save a
+        simulation to a file and pick it up again later. The method Export writes what Run shows to a video or GIF instead.
+        With engine = 'aggregate' the Random movers are simulated by a RandomPool, so that their cost depends on the size
+        of the country rather than how many there are.
 
 
     Simply running this script will give an example of the worst-case scenario of the SIR model.
@@ -48,71 +79,599 @@
 
 
 
-from random import choice, randint, random
-from matplotlib import pyplot as plt
-from matplotlib import animation
-from matplotlib.colors import ListedColormap
+#matplotlib is only imported by the methods which draw, so that the model can be used without loading it
 from math import sqrt
+import json
+import os
+import threading
 import numpy as np
 
+from Profiling import NullProfiler
+
+
+#Each state is stored as a small integer. These codes double as the values painted on the grid by
+#Simulation.Run, where 0 is an unoccupied square.
+StateCodes = {'S':1, 'I':2, 'R':3}
+S, I, R = StateCodes['S'], StateCodes['I'], StateCodes['R']
+
+#Each MoveType is stored as a small integer as well.
+MoveTypeCodes = {'Random':0, 'Drunkard':1, 'Isolate':2}
+
 
 ##############################################################################################################
 ##############################################################################################################
 ##############################################################################################################
-class Person:
+def Move_Random(Row, Col, Movers, N, rng):
+    '''Every iteration a Random mover will teleport to a randomly selected location in the country. Row and Col are
+        the location arrays of a population and Movers are the indices of the people to move.'''
 
-    def __init__(self, State, row, column, MoveType):
-        '''State is a single character string - either 'S' (susceptible), 'I' (infected), or 'R' (recovered) - indicating
-            the state of the person. row and column are integers indicating the location of the person on the two-dimensional
-            grid. MoveType will define how this person moves. If the person is initialized as Infected or Recovered, start
-            the appropriate counter to determine when they get better or become susceptible again.'''
+    Row[Movers] = rng.integers(0, N, len(Movers))
+    Col[Movers] = rng.integers(0, N, len(Movers))
 
-        self.State = State
-        self.Loc = [row, column]
-        self.MoveType = MoveType
 
-        if State == 'I':
-            self.Infected_Iters = 0
+def Move_Drunkard(Row, Col, Movers, N, rng):
+    '''Every iteration the Drunkard mover, randomly moves up, down, left, or right one square, or perhaps not at all.
+        Moving off one edge of the country brings the person back on at the opposite edge.'''
 
-        elif State == 'R':
-            self.Recovered_Iters = 0
+    #Pick whether each person moves along the rows or the columns, and by how much
+    Axis = rng.integers(0, 2, len(Movers))
+    Delta = rng.integers(-1, 2, len(Movers))
 
+    Vertical = Axis == 0
+    Horizontal = ~Vertical
 
-    def Move(self, N):
-        '''Move the person by updating his location according to his MoveType. If you want to define
-            your own way in which people move, define them for the given MoveType here.'''
-        
+    Row[Movers[Vertical]] = (Row[Movers[Vertical]] + Delta[Vertical]) % N
+    Col[Movers[Horizontal]] = (Col[Movers[Horizontal]] + Delta[Horizontal]) % N
 
-        if self.MoveType == 'Random':
-            #Every iteration a Random mover will teleport to a randomly selected location in the country.
 
-            row = randint(0, N-1)
-            col = randint(0, N-1)
+#The function used to move everyone of a given MoveType. If you want to define your own way in which people move,
+#write a function with the same arguments as those above and add it here. In a country with common random numbers, rng
+#only has the methods random and integers (see CommonRandom). Every iteration the Isolated mover does not move, so it has
+#no entry.
+MoveKernels = {MoveTypeCodes['Random']: Move_Random,
+               MoveTypeCodes['Drunkard']: Move_Drunkard}
+##############################################################################################################
+##############################################################################################################
+##############################################################################################################
 
-            self.Loc = row, col
 
-        elif self.MoveType == 'Drunkard':
-            #Every iteration the Drunkard mover, randomly moves up, down, left, or right one square,
-            #or perhaps not at all.
 
-            ind = choice([0, 1])
-            delta = choice([-1, 0, 1])
 
-            self.Loc[ind] += delta
+##############################################################################################################
+##############################################################################################################
+##############################################################################################################
+def Bin_People(Row, Col, N):
+    '''Returns an NxN matrix holding the number of people at each location, given the rows and columns of those people.'''
 
-            if self.Loc[ind] < 0:
-                self.Loc[ind] = N-1
+    return np.bincount(Row.astype(np.int64)*N + Col, minlength = N*N).reshape(N, N)
 
-            elif self.Loc[ind] == N:
-                self.Loc[ind] = 0
 
-        elif self.MoveType == 'Isolate':
-            #Every iteration the Isolated mover does not move.
+def Window_Sum(Grid, radius, wrap = True):
+    '''Sums Grid over a window of 2*radius+1 rows centered on each row, using cumulative sums so the cost does not
+        depend on radius, and returns the result transposed (so that calling this twice sums over both axes). If wrap
+        is True, the rows wrap around the edges of the Grid. Otherwise the first and last radius rows of Grid only serve
+        as the edges of the windows, and the result has 2*radius fewer columns than Grid has rows.'''
 
-            Move = False
+    Width = 2*radius + 1
 
-        else:
+    if wrap:
+        #Extend the Grid by radius rows on either side, wrapping around the edges
+        Grid = np.pad(Grid, [(radius, radius), (0, 0)], mode = 'wrap')
+
+    n = Grid.shape[0] - 2*radius
+
+    #The sum over any window is the difference of two cumulative sums
+    Total = np.zeros((Grid.shape[0] + 1, Grid.shape[1]), dtype = np.result_type(Grid.dtype, np.int64))
+    np.cumsum(Grid, axis = 0, out = Total[1:])
+
+    return (Total[Width:Width+n] - Total[:n]).T
+
+
+def Moore_Sum(Grid, radius):
+    '''Returns a matrix the same size as Grid where each location holds the sum of Grid over the Moore Neighborhood
+        of that location, i.e. the (2*radius+1)x(2*radius+1) square centered on it, with the edges of the Grid wrapping
+        around. The sum is done one axis at a time using Window_Sum, so the cost does not depend on radius.'''
+
+    return Window_Sum(Window_Sum(Grid, radius), radius)
+
+
+def Durations(Iters, n, rng):
+    '''Returns the number of iterations n people will spend in a state. Iters is either a whole number, which everyone
+        spends in the state, or a Sampled distribution from which a duration is drawn for each person.'''
+
+    if isinstance(Iters, Sampled):
+        return Iters(rng, n)
+
+    return Iters
+
+
+def _Check_Due(Due, dtype):
+    #Refuse to store an iteration too large for the Due array, rather than letting it wrap around
+    if np.size(Due) > 0 and np.max(Due) > np.iinfo(dtype).max:
+        raise ValueError(f'Iteration {np.max(Due)} does not fit in a {np.dtype(dtype).name} Due array; use a Country with compact = False')
+
+    return Due
+
+
+def Transition(People, Recovering, Waning, Exposed, nI, risk, t, Infected_Iters, Recovered_Iters, rng, streams = None):
+    '''Move people between states on iteration t. People holds the State and Due arrays (usually a Population). Recovering
+        and Waning are the indices of the infected and recovered persons who are due to change state on this iteration, and
+        Exposed are the indices of the susceptible persons with nI infected neighbors. See Country.Update_People. If streams
+        (a CommonRandom) is given, whether each exposed person becomes infected is drawn from their own stream, which needs
+        the ID array of People, rather than from rng. Returns the indices of the persons who went from I to R, from S to I,
+        and from R to S.'''
+
+    #Update each infected person whose time is up
+    People.State[Recovering] = R
+    People.Due[Recovering] = _Check_Due(t + Durations(Recovered_Iters, len(Recovering), rng), People.Due.dtype)
+
+    #Update each susceptible person with infected neighbors
+    Draws = rng if streams is None else streams.Stream('Infect', People.ID[Exposed], t)
+    pS = Exposed[Draws.random(len(Exposed)) < nI*risk]
+    People.State[pS] = I
+    People.Due[pS] = _Check_Due(t + Durations(Infected_Iters, len(pS), rng), People.Due.dtype)
+
+    #Update each recovered person whose time is up
+    People.State[Waning] = S
+
+    #Return who recovered, who became infected, and who became susceptible again
+    return Recovering, pS, Waning
+##############################################################################################################
+##############################################################################################################
+##############################################################################################################
+
+
+
+
+##############################################################################################################
+##############################################################################################################
+##############################################################################################################
+class Sampled:
+
+    def __init__(self, distribution, *args):
+        '''A random number of iterations, which can be given to a Simulation as Infected_Iters or Recovered_Iters in place of a
+            fixed number. distribution is the name of a method of numpy.random.Generator and args are its parameters, e.g.
+            Sampled('poisson', 100) or Sampled('geometric', 1/100). Draws are rounded to whole numbers of at least 1.'''
+
+        self.distribution = distribution
+        self.args = args
+
+
+    def __call__(self, rng, n):
+        Draws = getattr(rng, self.distribution)(*self.args, size = n)
+
+        return np.maximum(np.rint(Draws), 1).astype(np.int64)
+
+
+    def __repr__(self):
+        return f"Sampled({', '.join(repr(x) for x in (self.distribution,) + self.args)})"
+##############################################################################################################
+##############################################################################################################
+##############################################################################################################
+
+
+
+
+##############################################################################################################
+##############################################################################################################
+##############################################################################################################
+#What each stream of a CommonRandom is used for
+PurposeCodes = {'Place':0, 'Move':1, 'Infect':2}
+
+
+def _Mix(x):
+    #The finalizer of SplitMix64, which scrambles 64-bit integers so that nearby inputs give unrelated outputs. The
+    #multiplications are meant to wrap around.
+    with np.errstate(over = 'ignore'):
+        x = (x ^ (x >> np.uint64(30)))*np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27)))*np.uint64(0x94D049BB133111EB)
+
+        return x ^ (x >> np.uint64(31))
+
+
+class CommonRandom:
+
+    def __init__(self, seed = None):
+        '''Counter-based random numbers, where every draw is a hash of the key made from seed, what it is for (one of
+            PurposeCodes), the ID of the person it is for, the iteration, and how many draws that person has already made
+            for that purpose on that iteration. Nothing is kept between draws, so a person draws the same numbers no matter
+            who else is drawing, or in what order. Two simulations with the same seed therefore share the draws of everyone
+            whose circumstances are the same, which makes the difference between them much less noisy (common random
+            numbers). seed may be an integer, a sequence of integers, a numpy.random.SeedSequence, or None.'''
+
+        if not isinstance(seed, np.random.SeedSequence):
+            seed = np.random.SeedSequence(seed)
+
+        self.Key = seed.generate_state(2, np.uint64)
+
+
+    def Stream(self, purpose, IDs, t):
+        '''Returns the streams of the people with the given IDs for purpose on iteration t. These have the methods random
+            and integers of a numpy.random.Generator, and draw one number per person each time.'''
+
+        return _Streams(self.Key, PurposeCodes[purpose], IDs, t)
+
+
+    def To_JSON(self):
+        return [int(k) for k in self.Key]
+
+
+    @classmethod
+    def From_JSON(cls, Data):
+        Streams = cls()
+        Streams.Key = np.array(Data, dtype = np.uint64)
+
+        return Streams
+
+
+class _Streams:
+    #The streams of a group of people for one purpose on one iteration, which stand in for a numpy.random.Generator
+
+    def __init__(self, Key, purpose, IDs, t):
+        self.People = _Mix(np.asarray(IDs).astype(np.uint64)*np.uint64(0x9E3779B97F4A7C15) ^ Key[0])
+        self.Counter = _Mix(_Mix(Key[1] ^ np.uint64(purpose)) ^ np.uint64(t))
+        self.Draw = 0
+
+
+    def random(self, size = None):
+        if size is not None and size != len(self.People):
+            raise ValueError(f'Common random numbers draw one number per person, not {size} for {len(self.People)} people')
+
+        #Every draw gets a counter of its own, and the top 53 bits of the hash give a uniform number in [0, 1)
+        self.Draw += 1
+        Bits = _Mix(self.People ^ _Mix(self.Counter ^ np.uint64(self.Draw)))
+
+        return (Bits >> np.uint64(11))*2.0**-53
+
+
+    def integers(self, low, high = None, size = None):
+        if high is None:
+            low, high = 0, low
+
+        return low + (self.random(size)*(high - low)).astype(np.int64)
+##############################################################################################################
+##############################################################################################################
+##############################################################################################################
+
+
+
+
+##############################################################################################################
+##############################################################################################################
+##############################################################################################################
+def Scatter(n, Squares, rng):
+    '''Returns the number of people on each of Squares squares when n people are placed uniformly at random. When there
+        are more people than squares, a single multinomial draw is made, so the cost depends on the number of squares
+        rather than the number of people.'''
+
+    if n == 0:
+        return np.zeros(Squares, dtype = np.int64)
+
+    if n < Squares:
+        return np.bincount(rng.integers(0, Squares, n), minlength = Squares)
+
+    return rng.multinomial(n, np.full(Squares, 1/Squares))
+
+
+class RandomPool:
+
+    def __init__(self, N):
+        '''A RandomPool holds the Random movers of an NxN country as counts rather than as individual people. Susceptible
+            is the number of susceptible people, and Infected and Recovered map the iteration on which a group of people
+            changes state to the number of people in that group. Cells holds the number of people in each state on each
+            square (as row*N + column) since they were last scattered over the country.'''
+
+        self.N = N
+        self.Susceptible = 0
+        self.Infected = {}
+        self.Recovered = {}
+        self.Cells = {State: np.zeros(N*N, dtype = np.int64) for State in (S, I, R)}
+
+
+    def Total(self, State):
+        '''Returns the number of people in the pool in the given state code.'''
+
+        if State == S:
+            return self.Susceptible
+
+        return sum((self.Infected if State == I else self.Recovered).values())
+
+
+    def Add(self, State, Due):
+        '''Add people with the given state codes and Due iterations (arrays, one per person) to the pool.'''
+
+        self.Susceptible += int(np.count_nonzero(State == S))
+
+        for Code, Groups in ((I, self.Infected), (R, self.Recovered)):
+            Times, Counts = np.unique(Due[State == Code], return_counts = True)
+
+            for t, Count in zip(Times.tolist(), Counts.tolist()):
+                Groups[t] = Groups.get(t, 0) + Count
+
+
+    def _Add_Group(self, Groups, t, Iters, Count, rng):
+        #Add Count people who entered a state on iteration t, which they spend Iters iterations in
+        if Count == 0:
+            return
+
+        Times = t + Durations(Iters, Count, rng)
+
+        if np.ndim(Times) == 0:
+            Groups[int(Times)] = Groups.get(int(Times), 0) + Count
+            return
+
+        Times, Counts = np.unique(Times, return_counts = True)
+        for Time, Count in zip(Times.tolist(), Counts.tolist()):
+            Groups[Time] = Groups.get(Time, 0) + Count
+
+
+    def Scatter(self, rng):
+        '''Place everyone in the pool on a random square.'''
+
+        for State in (S, I, R):
+            self.Cells[State] = Scatter(self.Total(State), self.N**2, rng)
+
+
+    def Update(self, t, Squares, nI, risk, Infected_Iters, Recovered_Iters, rng):
+        '''Move the people in the pool between states on iteration t, the same way Transition does for individual people.
+            Squares are squares (as row*N + column) with nI infected neighbors. Returns the number of people who went from I
+            to R, from S to I, and from R to S.'''
+
+        Recovering = self.Infected.pop(t, 0)
+        Waning = self.Recovered.pop(t, 0)
+
+        #Each susceptible person on a square is infected with a probability of nI*risk
+        New = rng.binomial(self.Cells[S][Squares], np.minimum(nI*risk, 1))
+        nNew = int(New.sum())
+
+        self.Cells[S][Squares] -= New
+        self.Cells[I][Squares] += New
+
+        self._Add_Group(self.Recovered, t, Recovered_Iters, Recovering, rng)
+        self._Add_Group(self.Infected, t, Infected_Iters, nNew, rng)
+        self.Susceptible += Waning - nNew
+
+        return Recovering, nNew, Waning
+
+
+    def Paint(self):
+        '''Returns the state code to show on each square (as row*N + column): I if anyone there is infected, otherwise R if
+            anyone there is recovered, otherwise S if anyone is there, and 0 for an empty square.'''
+
+        Grid = np.zeros(self.N**2, dtype = np.int8)
+
+        for State in (S, R, I):
+            Grid[self.Cells[State] > 0] = State
+
+        return Grid
+
+
+    def To_JSON(self):
+        #The pool in a form json can store
+        return {'N': self.N, 'Susceptible': self.Susceptible,
+                'Infected': list(self.Infected.items()), 'Recovered': list(self.Recovered.items())}
+
+
+    @classmethod
+    def From_JSON(cls, Data):
+        Pool = cls(Data['N'])
+        Pool.Susceptible = Data['Susceptible']
+        Pool.Infected = {t: Count for t, Count in Data['Infected']}
+        Pool.Recovered = {t: Count for t, Count in Data['Recovered']}
+
+        return Pool
+##############################################################################################################
+##############################################################################################################
+##############################################################################################################
+
+
+
+
+##############################################################################################################
+##############################################################################################################
+##############################################################################################################
+class Schedule:
+
+    def __init__(self):
+        '''A Schedule keeps track of when each infected or recovered person is due to change state. The people due on each
+            iteration are kept together in a bucket, so each iteration only the people who are actually due are looked at,
+            no matter how many people are infected or recovered.'''
+
+        #The indices of the people due on each iteration, as a list of arrays
+        self.Buckets = {}
+
+
+    def __len__(self):
+        return sum(len(Part) for Parts in self.Buckets.values() for Part in Parts)
+
+
+    def Add(self, People, Due):
+        '''Schedule the people with indices People to change state on the iterations Due (an array, one per person).'''
+
+        if len(People) == 0:
+            return
+
+        if Due.min() == Due.max():
+            #Everyone is due on the same iteration, as happens when everyone spends the same time in a state
+            self.Buckets.setdefault(int(Due[0]), []).append(People)
+            return
+
+        Order = np.argsort(Due, kind = 'stable')
+        Due = Due[Order]
+        People = People[Order]
+
+        Times, Starts = np.unique(Due, return_index = True)
+        for t, Part in zip(Times, np.split(People, Starts[1:])):
+            self.Buckets.setdefault(int(t), []).append(Part)
+
+
+    def Pop(self, t):
+        '''Remove and return the indices of the people due on iteration t.'''
+
+        Parts = self.Buckets.pop(t, None)
+
+        if Parts is None:
+            return np.zeros(0, dtype = np.int64)
+
+        return np.concatenate(Parts)
+##############################################################################################################
+##############################################################################################################
+##############################################################################################################
+
+
+
+
+##############################################################################################################
+##############################################################################################################
+##############################################################################################################
+#The dtype of each array of a Population. Compact populations use the smallest types which will do, to fit as many
+#people into memory as possible (see Population_dtypes).
+DTYPES = {'State': np.int8, 'Row': np.int64, 'Col': np.int64, 'MoveType': np.int8, 'Due': np.int64, 'ID': np.int64}
+
+
+def Population_dtypes(N, compact = False):
+    '''Returns the dtypes of the arrays of a Population living in an NxN country. If compact is True, the locations are
+        stored in 16 bits if N allows it and 32 bits otherwise, and Due and ID are stored in 32 bits, which allows
+        simulations of up to about two billion iterations and four billion people.'''
+
+    if not compact:
+        return dict(DTYPES)
+
+    if N > 2**32:
+        raise ValueError(f'A country of size {N} is too big for a compact population')
+
+    Location = np.uint16 if N <= 2**16 else np.uint32
+
+    return {'State': np.int8, 'Row': Location, 'Col': Location, 'MoveType': np.int8, 'Due': np.int32, 'ID': np.uint32}
+
+
+class Population:
+
+    def __init__(self, capacity = 16, dtypes = None):
+        '''A Population stores the people living in a country as a set of NumPy arrays, one entry per person, rather than
+            as one object per person. State holds the state code of each person (see StateCodes), Row and Col hold the
+            location of each person on the two-dimensional grid, and MoveType holds the move type code of each person
+            (see MoveTypeCodes). Due holds the iteration on which an infected or recovered person changes state, or -1 if
+            that has not been decided yet. ID holds a number given to each person when they are added, which unlike their
+            index never changes, even when other people are removed. The arrays grow as people are added using the method
+            Append. dtypes gives the dtype of each array, and defaults to DTYPES.'''
+
+        #The number of people currently in the population, and the ID the next person added will get
+        self.size = 0
+        self.next_id = 0
+
+        #The underlying storage, which is larger than the population so that adding people is cheap
+        self._Buffers = {Name: np.zeros(capacity, dtype = dtype) for Name, dtype in (dtypes or DTYPES).items()}
+
+        self._SetViews()
+
+
+    def Bytes_Per_Person(self):
+        '''Returns the number of bytes used to store each person.'''
+
+        return sum(Buffer.itemsize for Buffer in self._Buffers.values())
+
+
+    def nbytes(self):
+        '''Returns the number of bytes of memory the population takes up, including room reserved for adding people.'''
+
+        return sum(Buffer.nbytes for Buffer in self._Buffers.values())
+
+
+    def __len__(self):
+        return self.size
+
+
+    def _SetViews(self):
+        #Expose each array trimmed to the size of the population
+        for name, Buffer in self._Buffers.items():
+            setattr(self, name, Buffer[:self.size])
+
+
+    def _Reserve(self, size):
+        #Make sure the underlying storage can hold size people, doubling it if it can not.
+        capacity = len(self._Buffers['State'])
+
+        if size <= capacity:
+            return
+
+        while capacity < size:
+            capacity *= 2
+
+        for name, Buffer in self._Buffers.items():
+            NewBuffer = np.zeros(capacity, dtype = Buffer.dtype)
+            NewBuffer[:self.size] = Buffer[:self.size]
+            self._Buffers[name] = NewBuffer
+
+
+    def Append(self, State, row, column, MoveType):
+        '''Add a single person to the population. State is a single character string - either 'S' (susceptible), 'I' (infected),
+            or 'R' (recovered). row and column are integers indicating the location of the person. MoveType is one of the keys of
+            MoveTypeCodes and defines how this person moves. When the person will change state is decided by the country
+            on its next update.'''
+
+        if State not in StateCodes:
+            raise ValueError(f'State {State} not defined!')
+
+        if MoveType not in MoveTypeCodes:
             raise ValueError(f'MoveType {MoveType} not defined!')
+
+        i = self.size
+        self._Reserve(i + 1)
+
+        self._Buffers['State'][i] = StateCodes[State]
+        self._Buffers['Row'][i] = row
+        self._Buffers['Col'][i] = column
+        self._Buffers['MoveType'][i] = MoveTypeCodes[MoveType]
+        self._Buffers['Due'][i] = -1
+        self._Buffers['ID'][i] = self._New_IDs(1)[0]
+
+        self.size += 1
+        self._SetViews()
+
+
+    def Keep(self, Index):
+        '''Keep only the people with the given indices (in increasing order), removing everyone else. Everyone who is kept
+            moves to a new index.'''
+
+        n = len(Index)
+
+        for Buffer in self._Buffers.values():
+            Buffer[:n] = Buffer[Index]
+
+        self.size = n
+        self._SetViews()
+
+
+    def _New_IDs(self, n):
+        #Hand out the next n IDs, refusing to wrap around
+        if self.next_id + n - 1 > np.iinfo(self._Buffers['ID'].dtype).max:
+            raise ValueError('The population has run out of IDs; use a Country with compact = False')
+
+        IDs = np.arange(self.next_id, self.next_id + n)
+        self.next_id += n
+
+        return IDs
+
+
+    def Extend(self, State, Row, Col, MoveType):
+        '''Add many people to the population at once. Row and Col are arrays with the location of each person, and State and
+            MoveType are the codes (see StateCodes and MoveTypeCodes) of their states and move types, either as arrays or as
+            a single code shared by everyone.'''
+
+        i = self.size
+        n = len(Row)
+        self._Reserve(i + n)
+
+        self._Buffers['State'][i:i+n] = State
+        self._Buffers['Row'][i:i+n] = Row
+        self._Buffers['Col'][i:i+n] = Col
+        self._Buffers['MoveType'][i:i+n] = MoveType
+        self._Buffers['Due'][i:i+n] = -1
+        self._Buffers['ID'][i:i+n] = self._New_IDs(n)
+
+        self.size += n
+        self._SetViews()
 ##############################################################################################################
 ##############################################################################################################
 ##############################################################################################################
@@ -125,15 +684,65 @@ class Person:
 ##############################################################################################################
 class Country:
 
-    def __init__(self, N = 100):
+    def __init__(self, N = 100, seed = None, sparse_threshold = None, compact = False, common_random = False):
         '''N is a positive integer indicating the size of the country. You can add people to the country using the Add_Person method.
-            The methods Move_People, Update_People, and GetInfectedNeighbors are used by the Simulation Class.'''
+            The methods Move_People, Update_People, and GetInfectedNeighbors are used by the Simulation Class. seed is used to
+            initialize the random number generator of the country, so that a simulation can be repeated exactly. sparse_threshold
+            is the largest number of infected persons for which Update_People only looks at the squares around them (see Use_Sparse).
+            If compact is True, the people are stored using as little memory as possible (see Population_dtypes). If common_random
+            is True, where each person is placed, how they move, and whether they become infected are drawn from streams of
+            their own (see CommonRandom), so that two scenarios run with the same seed share those draws wherever they agree.'''
 
         #Set the size of the country
         self.N = N
+        self.compact = compact
+        self.common_random = common_random
+
+        #The number of infected persons below which Update_People only looks near the infected persons
+        self.sparse_threshold = sparse_threshold
+
+        #Create an empty population which will contain the people living in this country
+        self.People = Population(dtypes = Population_dtypes(N, compact))
+
+        #The number of people in each state (indexed by StateCodes) with each MoveType (indexed by MoveTypeCodes)
+        self.Counts = np.zeros((len(StateCodes) + 1, len(MoveTypeCodes)), dtype = np.int64)
+
+        #The number of times the people have been updated, and when each infected or recovered person changes state.
+        #People added since the last update have not been scheduled yet.
+        self.Iteration = 0
+        self.Schedule = Schedule()
+        self._Pending = []
 
-        #Create an empty list which will contain the people living in this country
-        self.People = []
+        #Random movers which are counted rather than tracked one by one (see Aggregate_Random)
+        self.Pool = None
+
+        #Times the phases of each iteration (see Profiling.py). The NullProfiler records nothing.
+        self.profiler = NullProfiler()
+
+        #Records who infected whom (see Provenance.py). Nothing is recorded if it is None.
+        self.provenance = None
+
+        #The random number generator used for placing, moving, and infecting people
+        self.Seed(seed)
+
+
+    def Seed(self, seed = None):
+        '''Replace the random number generator of the country with a new one initialized from seed, which may be
+            anything accepted by numpy.random.default_rng (e.g. an integer or a numpy.random.SeedSequence). If the country
+            uses common random numbers, its streams are keyed by seed as well, which must then be an integer, a sequence
+            of integers, a numpy.random.SeedSequence, or None.'''
+
+        self.rng = np.random.default_rng(seed)
+        self.streams = CommonRandom(seed) if self.common_random else None
+
+
+    def _Draws(self, purpose, IDs):
+        #What to draw the random numbers of the people with the given IDs from: their own streams for purpose if the
+        #country uses common random numbers, and the random number generator of the country otherwise
+        if self.streams is None:
+            return self.rng
+
+        return self.streams.Stream(purpose, IDs, self.Iteration)
 
 
     def Add_Person(self, State, row = None, column = None, MoveType = None):
@@ -142,121 +751,650 @@ class Country:
 
         N = self.N
 
+        if self.streams is not None:
+            #Draw both from the person's own stream, so they land where Add_Population would have put them
+            Draws = self._Draws('Place', np.array([self.People.next_id]))
+            Location = Draws.integers(0, N, 1)[0], Draws.integers(0, N, 1)[0]
+
         if row == None:
             #Randomly chose a row
-            row = randint(0, N-1)
+            row = self.rng.integers(0, N) if self.streams is None else Location[0]
 
         if  column == None:
             #Randomly chose a column
-            column = randint(0, N-1)
+            column = self.rng.integers(0, N) if self.streams is None else Location[1]
 
         if MoveType == None:
             MoveType = 'Random'
 
-        #Add this person to the list of people.
-        self.People.append(Person(State, row, column, MoveType))
+        #Add this person to the population.
+        self.People.Append(State, row, column, MoveType)
+        self.Counts[StateCodes[State], MoveTypeCodes[MoveType]] += 1
+
+        if State != 'S':
+            self._Pending.append(np.array([len(self.People) - 1]))
+
+
+    def Add_Population(self, count, State, MoveType = 'Random', placement = None):
+        '''Add count people, all in the given State and with the given MoveType, to the country at once. This is much faster
+            than calling Add_Person count times. placement decides where they go:
+                None                - each person is placed uniformly at random.
+                an NxN array        - each person is placed at random with the probability of each square proportional
+                                      to the value of the array there, e.g. a map of population density.
+                a tuple (rows, cols) - the people are placed at these locations, which must be arrays of length count.'''
+
+        N = self.N
+
+        if State not in StateCodes:
+            raise ValueError(f'State {State} not defined!')
+
+        if MoveType not in MoveTypeCodes:
+            raise ValueError(f'MoveType {MoveType} not defined!')
+
+        Draws = self._Draws('Place', np.arange(self.People.next_id, self.People.next_id + count))
+
+        if placement is None:
+            rows = Draws.integers(0, N, count)
+            cols = Draws.integers(0, N, count)
+
+        elif isinstance(placement, tuple):
+            rows, cols = (np.asarray(x, dtype = np.int64) for x in placement)
+
+            if len(rows) != count or len(cols) != count:
+                raise ValueError(f'placement must give {count} rows and columns')
+
+            if min(rows.min(initial = 0), cols.min(initial = 0)) < 0 or max(rows.max(initial = 0), cols.max(initial = 0)) >= N:
+                raise ValueError(f'placement must lie within the {N}x{N} country')
+
+        else:
+            Density = np.asarray(placement, dtype = np.float64)
+
+            if Density.shape != (N, N) or Density.min() < 0 or Density.sum() <= 0:
+                raise ValueError(f'placement must be an {N}x{N} array of non-negative weights which are not all 0')
+
+            #Draw a square for each person by inverting the cumulative distribution of the weights
+            Total = np.cumsum(Density.ravel())
+            Squares = np.searchsorted(Total, Draws.random(count)*Total[-1], side = 'right')
+            Squares = np.minimum(Squares, N*N - 1)
+            rows, cols = Squares//N, Squares % N
+
+        Start = len(self.People)
+        self.People.Extend(StateCodes[State], rows, cols, MoveTypeCodes[MoveType])
+        self.Counts[StateCodes[State], MoveTypeCodes[MoveType]] += count
+
+        if State != 'S':
+            self._Pending.append(np.arange(Start, Start + count))
+
+
+    def Emigrate(self, Index):
+        '''Remove the people with the given indices from the country, and return them as a dictionary of arrays which can
+            be given to Immigrate of another country: State and MoveType hold their codes, and Remaining the number of
+            iterations until they change state (-1 where that has not been decided yet). IDs are not kept, since each
+            country numbers its own people.'''
+
+        People = self.People
+        Index = np.unique(Index)
+
+        Due = People.Due[Index].astype(np.int64)
+        Migrants = {'State': People.State[Index].copy(),
+                    'MoveType': People.MoveType[Index].copy(),
+                    'Remaining': np.where(Due >= 0, Due - self.Iteration, -1)}
+
+        Staying = np.ones(len(People), dtype = bool)
+        Staying[Index] = False
+        People.Keep(np.flatnonzero(Staying))
+
+        Codes = Migrants['State'].astype(np.int64)*len(MoveTypeCodes) + Migrants['MoveType']
+        self.Counts -= np.bincount(Codes, minlength = self.Counts.size).reshape(self.Counts.shape)
+
+        #Removing people changes everyone's index, so the Schedule has to be rebuilt
+        self.Rebuild_Schedule()
+
+        return Migrants
+
+
+    def Immigrate(self, Migrants):
+        '''Add the people returned by Emigrate of another country, each at a random square. They change state after the
+            same number of iterations as they would have where they came from.'''
+
+        People = self.People
+        n = len(Migrants['State'])
+
+        if n == 0:
+            return
+
+        Start = len(People)
+        Draws = self._Draws('Place', np.arange(People.next_id, People.next_id + n))
+        People.Extend(Migrants['State'], Draws.integers(0, self.N, n), Draws.integers(0, self.N, n), Migrants['MoveType'])
+
+        Codes = Migrants['State'].astype(np.int64)*len(MoveTypeCodes) + Migrants['MoveType']
+        self.Counts += np.bincount(Codes, minlength = self.Counts.size).reshape(self.Counts.shape)
+
+        Index = np.arange(Start, Start + n)
+        Remaining = Migrants['Remaining']
+        Scheduled = Index[Remaining >= 0]
+
+        People.Due[Scheduled] = _Check_Due(self.Iteration + Remaining[Remaining >= 0], People.Due.dtype)
+        self.Schedule.Add(Scheduled, People.Due[Scheduled])
+
+        #Anyone whose time in their state was not decided yet is decided here
+        self._Pending.append(Index[(Remaining < 0) & (Migrants['State'] != S)])
+
+
+    def Schedule_Pending(self, Infected_Iters, Recovered_Iters):
+        '''Decide when each infected or recovered person added since the last update changes state, counting from the
+            current iteration.'''
+
+        if len(self._Pending) == 0:
+            return
+
+        People = self.People
+        Pending = np.concatenate(self._Pending)
+        self._Pending = []
+
+        for State, Iters in ((I, Infected_Iters), (R, Recovered_Iters)):
+            Entered = Pending[People.State[Pending] == State]
+            People.Due[Entered] = _Check_Due(self.Iteration + Durations(Iters, len(Entered), self.rng), People.Due.dtype)
+            self.Schedule.Add(Entered, People.Due[Entered])
+
+
+    def Rebuild_Schedule(self):
+        '''Rebuild the Schedule from the Due array of the population. This is only needed if the arrays of the Population
+            have been changed directly, rather than through the methods of the country.'''
+
+        People = self.People
+        Changing = People.State != S
+
+        self.Schedule = Schedule()
+        Scheduled = np.flatnonzero(Changing & (People.Due > self.Iteration))
+        self.Schedule.Add(Scheduled, People.Due[Scheduled])
+
+        self._Pending = [np.flatnonzero(Changing & (People.Due < 0))]
+
+
+    def _Shift(self, Moved, From, To):
+        #Move the people with indices Moved from the count of state From to the count of state To
+        if len(Moved) > 0:
+            Moved = np.bincount(self.People.MoveType[Moved], minlength = len(MoveTypeCodes))
+            self.Counts[From] -= Moved
+            self.Counts[To] += Moved
+
+
+    def Recount(self):
+        '''Count the number of people in each state with each MoveType from scratch. This is only needed if the arrays of
+            the Population have been changed directly, rather than through the methods of the country.'''
+
+        People = self.People
+        Codes = People.State.astype(np.int64)*len(MoveTypeCodes) + People.MoveType
+
+        self.Counts = np.bincount(Codes, minlength = self.Counts.size).reshape(self.Counts.shape)
+
+        if self.Pool is not None:
+            for State in (S, I, R):
+                self.Counts[State, MoveTypeCodes['Random']] += self.Pool.Total(State)
+
+
+    def Count(self, State = None, MoveType = None):
+        '''Returns the number of people in the given State ('S', 'I', or 'R') with the given MoveType. If either is None,
+            people in any state, or with any MoveType, are counted. The counts are kept up to date as people are added and
+            change state, so this does not look at the population at all.'''
+
+        Counts = self.Counts
+
+        if State is not None:
+            Counts = Counts[StateCodes[State]]
+        if MoveType is not None:
+            Counts = Counts[..., MoveTypeCodes[MoveType]]
+
+        return int(Counts.sum())
+
+
+    def Paint(self, Grid = None):
+        '''Returns an NxN matrix where the square of each person holds the code of their state (see StateCodes), and
+            every unoccupied square holds 0. If Grid is given, it is painted over and returned rather than a new matrix.'''
+
+        if Grid is None:
+            Grid = np.zeros((self.N, self.N), dtype = np.int8)
+        else:
+            Grid.fill(0)
+
+        Grid[self.People.Row, self.People.Col] = self.People.State
+
+        if self.Pool is not None:
+            #Squares with no one else on them show the people of the Pool, with the infected shown over the others
+            PoolGrid = self.Pool.Paint().reshape(self.N, self.N)
+            np.copyto(Grid, PoolGrid, where = Grid == 0)
+
+        return Grid
 
 
     def Move_People(self):
-        #Move each person in the country.
-        for P in self.People:
-            P.Move(self.N)
+        '''Move each person in the country according to their MoveType, using the functions in MoveKernels.'''
+
+        People = self.People
+
+        #Everyone with the same MoveType is moved at once. Isolated movers have no kernel and are never touched.
+        for MoveType, Kernel in MoveKernels.items():
+            Movers = np.flatnonzero(People.MoveType == MoveType)
+
+            if len(Movers) > 0:
+                Kernel(People.Row, People.Col, Movers, self.N, self.rng if self.streams is None else self._Draws('Move', People.ID[Movers]))
+
+        #The Random movers in the Pool are scattered over the country all at once
+        if self.Pool is not None:
+            self.Pool.Scatter(self.rng)
+
 
     def GetInfectedNeighbors(self, radius = 1):
         '''Determines the number of infected neighbors (within Moore Neighborhood radius r) on each location
-            in the city and returns that information in an NxN matrix.'''
+            in the city and returns that information in an NxN matrix. The Moore Neighborhood of a location is the
+            (2r+1)x(2r+1) square of locations centered on it, including the location itself, where the edges of
+            the country wrap around.'''
 
         #First find all of the infected persons
-        pI = [P for P in self.People if P.State == 'I']
+        pI = self.People.State == I
 
-        #Create a Grid based on the infected persons locations
-        N = self.N
-        Grid = np.zeros((N, N))
+        #Create a Grid which holds the number of infected persons at each location
+        Grid = Bin_People(self.People.Row[pI], self.People.Col[pI], self.N)
 
-        #For each infected person, add 1 to the location in the Grid
-        for p in pI:
-            r, c = p.Loc
-            Grid[r][c] += 1
+        if self.Pool is not None:
+            Grid += self.Pool.Cells[I].reshape(self.N, self.N)
 
-        #Now create an extended Grid which will hold the number of infected neighbors at each location
-        ExtendedGrid = np.zeros((N + 2*radius, N + 2*radius))
+        #Now add up the number of Infected Neighbors at each cell (including the cell itself)
+        return Moore_Sum(Grid, radius)
 
-        #Insert the Grid into the ExtendedGrid
-        ExtendedGrid[radius:N+radius, radius:N+radius] = Grid
 
-        #Now the last radius rows become the first radius rows, and so forth.
-        #Don't forget the corners!
+    def Use_Sparse(self, nInfected, radius):
+        '''Returns True if the neighbors of nInfected infected persons should be found with GetExposed rather than
+            GetInfectedNeighbors. If sparse_threshold was given to the country, that is the largest number of infected
+            persons for which GetExposed is used. Otherwise GetExposed is used whenever the squares around the infected
+            persons cover less than a sixteenth of the country.'''
 
-        #Make the first rows the last rows
-        ExtendedGrid[0:radius, radius:N+radius] = Grid[-radius:, :]
+        if self.sparse_threshold is not None:
+            return nInfected <= self.sparse_threshold
 
-        #Make the last rows the first rows
-        ExtendedGrid[N:N+radius, radius:N+radius] = Grid[0:radius, :]
+        return 16*nInfected*(2*radius + 1)**2 <= self.N**2
 
-        #Make the first columns the last columns
-        ExtendedGrid[radius:N+radius, 0:radius] = Grid[:, -radius:]
 
-        #Make the last columns the first columns
-        ExtendedGrid[radius:N+radius, N:N+radius] = Grid[:, 0:radius]
+    def Infected_Squares(self, Infected, radius = 1):
+        '''Given the indices of the Infected persons, returns every square with at least one infected person in its Moore
+            Neighborhood of the given radius (as row*N + column, in increasing order) and the number of infected neighbors
+            of each. Infected persons in the Pool are included.'''
 
-        #Now do the corners
+        People = self.People
+        N = self.N
+        Offsets = np.arange(-radius, radius + 1)
 
-        #Top Left = Bottom Right
-        ExtendedGrid[0:radius, 0:radius] = Grid[-radius:, -radius:]
+        InfectedRows = People.Row[Infected].astype(np.int64)
+        InfectedCols = People.Col[Infected].astype(np.int64)
 
-        #Bottom Right = Top Left
-        ExtendedGrid[-radius:, -radius:] = Grid[0:radius, 0:radius]
+        if self.Pool is not None:
+            Squares = np.flatnonzero(self.Pool.Cells[I])
+            Squares = np.repeat(Squares, self.Pool.Cells[I][Squares])
+            InfectedRows = np.concatenate([InfectedRows, Squares//N])
+            InfectedCols = np.concatenate([InfectedCols, Squares % N])
 
-        #Top Right = Bottom Left
-        ExtendedGrid[0:radius, -radius:] = Grid[-radius:, 0:radius]
+        #Every square within the Moore Neighborhood of each infected person, once per infected person
+        Rows = (InfectedRows[:, None] + Offsets) % N
+        Cols = (InfectedCols[:, None] + Offsets) % N
+        Squares = (Rows[:, :, None]*N + Cols[:, None, :]).ravel()
 
-        #Bottom Left = Top Right
-        ExtendedGrid[-radius:, 0:radius] = Grid[0:radius, -radius:]
+        #The number of infected neighbors of each of those squares
+        return np.unique(Squares, return_counts = True)
 
-        #Now add up the number of Infected Neighbors at each cell (including the cell itself)
-        Neighbors = np.zeros((N,N))
-        for i in range(radius+2):
-            for j in range(radius+2):
-                Neighbors += ExtendedGrid[i:N+i, j:N+j]
 
-        return Neighbors
-            
+    def GetExposed(self, Infected, Susceptible, radius = 1):
+        '''Given the indices of the Infected and Susceptible persons, determines which susceptible persons have at least
+            one infected person in their Moore Neighborhood of the given radius. Returns the indices of those persons and the
+            number of infected neighbors each of them has. This only looks at the squares around the infected persons, so it
+            is much faster than GetInfectedNeighbors when there are few of them.'''
+
+        return self._Lookup(*self.Infected_Squares(Infected, radius), Susceptible)
+
+
+    def _Lookup(self, Squares, Counts, Susceptible):
+        #Find the Susceptible persons standing on one of Squares, and the Counts of their squares
+        People = self.People
+
+        if len(Squares) == 0:
+            return Susceptible[:0], Counts
+
+        #Look up the square of each susceptible person among them
+        Location = People.Row[Susceptible].astype(np.int64)*self.N + People.Col[Susceptible]
+        Position = np.minimum(np.searchsorted(Squares, Location), len(Squares) - 1)
+        Found = Squares[Position] == Location
+
+        return Susceptible[Found], Counts[Position[Found]]
+
 
     def Update_People(self, risk, radius, Infected_Iters, Recovered_Iters):
         '''For each suceptible person, determine the number of infected persons (nI) in their Moore neighborhood of the given radius.
             That susceptible person will become infected with a probability of nI*risk. If any Infected person has been infected for Infected_Iters
             number of iterations, he becomes Recovered. Similarly, and Recovered person who has been recovered for Recovered_Iters iterations
-            becomes susceptible again.'''
+            becomes susceptible again. Infected_Iters and Recovered_Iters may also be Sampled, in which case each person spends a random
+            number of iterations in that state. When a person enters a state, they are put on the Schedule for the iteration on which they
+            leave it, so only the people who are due are looked at. The people in the Pool, if there is one, are updated in the same way.'''
+
+        People = self.People
+        N = self.N
+        Pool = self.Pool
+        Profile = self.profiler
+
+        with Profile('Schedule'):
+            #Schedule anyone added since the last update, then move on to the next iteration
+            self.Schedule_Pending(Infected_Iters, Recovered_Iters)
+            self.Iteration += 1
+
+            #Find the infected and recovered persons who are due to change state. They are sorted so that the order in which
+            #they were put on the Schedule (which is lost when it is rebuilt) does not matter.
+            Due = np.sort(self.Schedule.Pop(self.Iteration))
+            Due = Due[People.Due[Due] == self.Iteration]
+            Recovering = Due[People.State[Due] == I]
+            Waning = Due[People.State[Due] == R]
+
+        with Profile('Neighbors'):
+            #Find the susceptible and infected persons in the country.
+            Susceptible = np.flatnonzero(People.State == S)
+            Infected = np.flatnonzero(People.State == I)
+            nInfected = len(Infected) + (0 if Pool is None else Pool.Total(I))
+
+            #Find the susceptible persons with infected neighbors, and how many. When there are only a few infected
+            #persons it is cheaper to only look at the squares around them than to count over the whole country.
+            if self.Use_Sparse(nInfected, radius):
+                Squares, Counts = self.Infected_Squares(Infected, radius)
+                Exposed, nI = self._Lookup(Squares, Counts, Susceptible)
+            else:
+                Neighbors = self.GetInfectedNeighbors(radius)
+                Exposed = Susceptible
+                nI = Neighbors[People.Row[Susceptible], People.Col[Susceptible]]
+
+                if Pool is not None:
+                    Squares = np.flatnonzero(Pool.Cells[S])
+                    Counts = Neighbors[Squares//N, Squares % N]
+
+        with Profile('Transition'):
+            pI, pS, pR = Transition(People, Recovering, Waning, Exposed, nI, risk, self.Iteration, Infected_Iters, Recovered_Iters, self.rng,
+                                    self.streams)
+
+            #Put everyone who entered a new state on the Schedule
+            self.Schedule.Add(pI, People.Due[pI])
+            self.Schedule.Add(pS, People.Due[pS])
+
+            #Keep the number of people in each state up to date
+            self._Shift(pI, I, R)
+            self._Shift(pS, S, I)
+            self._Shift(pR, R, S)
+
+        if self.provenance is not None:
+            with Profile('Provenance'):
+                #Everyone in Infected was infected at the start of this iteration, so could have passed it on
+                self.provenance.Record(self, Infected, pS, radius)
+
+        if Pool is not None:
+            with Profile('Pool'):
+                Changes = Pool.Update(self.Iteration, Squares, Counts, risk, Infected_Iters, Recovered_Iters, self.rng)
+
+                for Change, (From, To) in zip(Changes, ((I, R), (S, I), (R, S))):
+                    self.Counts[From, MoveTypeCodes['Random']] -= Change
+                    self.Counts[To, MoveTypeCodes['Random']] += Change
+
+
+    def Aggregate_Random(self, Infected_Iters, Recovered_Iters):
+        '''Take every Random mover out of the population and put them in the Pool, where they are only counted rather than
+            tracked one by one. Since a Random mover teleports to a random square every iteration, who they are makes no
+            difference to how the disease spreads. Infected_Iters and Recovered_Iters are used to decide when anyone added
+            since the last update changes state.'''
+
+        People = self.People
+        self.Schedule_Pending(Infected_Iters, Recovered_Iters)
+
+        Random = People.MoveType == MoveTypeCodes['Random']
+
+        if self.Pool is None:
+            self.Pool = RandomPool(self.N)
+
+        self.Pool.Add(People.State[Random], People.Due[Random])
+        self.Pool.Scatter(self.rng)
+
+        #Removing people changes everyone's index, so the Schedule has to be rebuilt
+        People.Keep(np.flatnonzero(~Random))
+        self.Rebuild_Schedule()
+##############################################################################################################
+##############################################################################################################
+##############################################################################################################
+
+
+
+
+##############################################################################################################
+##############################################################################################################
+##############################################################################################################
+def _Iters_To_JSON(Iters):
+    #A number of iterations, or a Sampled distribution of them, in a form json can store
+    if isinstance(Iters, Sampled):
+        return {'distribution': Iters.distribution, 'args': list(Iters.args)}
+
+    return int(Iters)
+
+
+def _Iters_From_JSON(Iters):
+    if isinstance(Iters, dict):
+        return Sampled(Iters['distribution'], *Iters['args'])
+
+    return Iters
+
+
+def Draw_Figure(fig, Grid, tData, SData, IData, RData, HCData):
+    '''Draw the plots of a simulation on the matplotlib Figure fig: the proportion of the population in each state over
+        time on the left, and the Grid painted by Country.Paint on the right. Returns the left axis, the image of the Grid,
+        and the lines for S, I, R, and the hospital capacity, so that they can be updated as the simulation runs.'''
+
+    #The left axis will be for plotting the distribution over time
+    #The right axis will be for plotting the people moving
+    #Below we set many features of these two axes
+    ax_Left = fig.add_subplot(121)
+    ax_Left.set_ylim([0, 1.01])
+    ax_Left.set_xlabel('Time', fontsize = 10)
+    ax_Right = fig.add_subplot(122)
+    ax_Right.set_title('The Country\nof Elbonia', fontsize = 10)
+    ax_Right.set_xticks([])
+    ax_Right.set_xticklabels([])
+    ax_Right.set_yticks([])
+    ax_Right.set_yticklabels([])
+    ax_Right.tick_params(axis=u'both', which=u'both',length=0)
+
+
+    from matplotlib.colors import ListedColormap
+
+    #Colormap
+    #Let 0 be white (unoccupied), 1 be Susceptible, 2 be Infected, 3 be Recovered
+    cmap = ListedColormap(['w', 'y', 'r', 'b'])
+
+    #Initialize the plots on the first frame
+    mat = ax_Right.matshow(Grid, cmap = cmap, vmin = 0, vmax = 3)
+    lineS, = ax_Left.plot(tData, SData, 'y', label = 'S')
+    lineI, = ax_Left.plot(tData, IData, 'r', label = 'I')
+    lineR, = ax_Left.plot(tData, IData, 'b', label = 'R')
+    lineHC, = ax_Left.plot(tData, HCData, 'k--')
+
+    #Legend
+    ax_Left.legend(loc='upper center', bbox_to_anchor=(0.5, 1.25),
+      fancybox=True, shadow=True, ncol=3, fontsize = 10)
+
+    return ax_Left, mat, lineS, lineI, lineR, lineHC
+
+
+class _Series:
+    '''The curves drawn by Simulation.Run, as one row of (iteration, S, I, R, hospital capacity) per iteration. The rows
+        are kept in a NumPy buffer which doubles in size whenever it fills up, so adding one costs the same however
+        long the simulation has run. Rows are never changed once added, so the first size rows of any buffer handed
+        out by Latest can be read while more rows are being added.'''
+
+    def __init__(self, Row, capacity = 1024):
+        self.Data = np.zeros((capacity, 5))
+        self.size = 0
+        self.Append(Row)
+
+
+    def Append(self, Row):
+        if self.size == len(self.Data):
+            Data = np.zeros((2*len(self.Data), 5))
+            Data[:self.size] = self.Data[:self.size]
+            self.Data = Data
+
+        self.Data[self.size] = Row
+        self.size += 1
+
+
+    def Latest(self):
+        '''Returns the current buffer and the number of rows in it. This is all that has to be done while holding a lock.'''
+
+        return self.Data, self.size
+
+
+def _Decimate(Data, n, points):
+    #Every k-th of the first n rows of Data, so that at most about points rows are drawn, always ending on the last row
+    k = max(1, -(-n//points))
+    Rows = Data[:n:k]
+
+    if (n - 1) % k != 0:
+        Rows = np.concatenate([Rows, Data[n-1:n]])
+
+    return Rows
+
+
+class SteadyState:
+
+    def __init__(self, window = 500, tolerance = 0.02, patience = 2):
+        '''Watches the proportion of the population in each state as a simulation runs, to tell when it has settled down,
+            e.g. into the endemic equilibrium of an SIRS model. The iterations are split into blocks of window iterations,
+            and the simulation is steady once the mean proportion in each state over a block has been within tolerance of
+            that over the block before it patience times in a row. Only the running sum of the current block and the
+            means of the last one are kept, so the memory used does not grow with the length of the run.'''
+
+        if window < 1:
+            raise ValueError('window must be at least 1')
+
+        self.window = window
+        self.tolerance = tolerance
+        self.patience = patience
+        self.Reset()
+
 
-        #Find each type of person in the country.
-        Susceptible = [P for P in self.People if P.State == 'S']
-        Infected = [P for P in self.People if P.State == 'I']
-        Recovered = [P for P in self.People if P.State == 'R']
+    def Reset(self):
+        '''Forget every iteration seen so far.'''
 
-        #For each location in the country, determine the number of infected neighbors.
-        Neighbors = self.GetInfectedNeighbors(radius)
+        #The sum of the proportions over the current block, and how many iterations are in it so far
+        self.Sum = np.zeros(3)
+        self.count = 0
 
-        #Update each infected person
-        for pI in Infected:
-            pI.Infected_Iters += 1
-            if pI.Infected_Iters == Infected_Iters:
-                pI.State = 'R'
-                pI.Recovered_Iters = 0
+        #The mean proportions over the last full block, and the number of blocks in a row which were close to the one before
+        self.Last = None
+        self.Held = 0
 
-        #Update each susceptible person
-        for pS in Susceptible:
-            row, col = pS.Loc
-            nI = Neighbors[row][col]
 
-            if random() < nI*risk:
-                pS.State = 'I'
-                pS.Infected_Iters = 0
+    def Add(self, Fractions):
+        '''Add the proportions of S, I, and R after an iteration.'''
 
-        #Update each recovered person
-        for pR in Recovered:
-            pR.Recovered_Iters += 1
-            if pR.Recovered_Iters == Recovered_Iters:
-                pR.State = 'S'
+        self.Sum += Fractions
+        self.count += 1
+
+        if self.count == self.window:
+            Mean = self.Sum/self.window
+
+            if self.Last is not None:
+                self.Held = self.Held + 1 if np.all(np.abs(Mean - self.Last) <= self.tolerance) else 0
+
+            self.Last = Mean
+            self.Sum = np.zeros(3)
+            self.count = 0
+
+
+    def Steady(self):
+        '''Returns True once patience blocks in a row have been within tolerance of the block before them.'''
+
+        return self.Held >= self.patience
+
+
+    def To_JSON(self):
+        #The detector in a form json can store
+        return {'window': self.window, 'tolerance': self.tolerance, 'patience': self.patience,
+                'Sum': self.Sum.tolist(), 'count': self.count, 'Held': self.Held,
+                'Last': None if self.Last is None else self.Last.tolist()}
+
+
+    @classmethod
+    def From_JSON(cls, Data):
+        Detector = cls(Data['window'], Data['tolerance'], Data['patience'])
+        Detector.Sum = np.array(Data['Sum'])
+        Detector.count = Data['count']
+        Detector.Held = Data['Held']
+        Detector.Last = None if Data['Last'] is None else np.array(Data['Last'])
+
+        return Detector
+##############################################################################################################
+##############################################################################################################
+##############################################################################################################
+
+
+
+
+##############################################################################################################
+##############################################################################################################
+##############################################################################################################
+class StepView:
+
+    def __init__(self, sim):
+        '''A read-only view of the state of the Simulation sim, as yielded by Simulation.Iter_Steps. Nothing is copied:
+            Counts is the country's own array of the number of people in each state (by state code) with each MoveType
+            (by MoveType code), and Grid is painted on first use into a buffer which is reused every iteration. A view
+            is only good until the simulation takes another step, after which using it raises a ValueError.'''
+
+        self.sim = sim
+        self.t = sim.iters
+
+        self._Counts = sim.country.Counts.view()
+        self._Counts.flags.writeable = False
+
+
+    def _Check(self):
+        if self.sim.iters != self.t:
+            raise ValueError(f'This view is of iteration {self.t}, but the simulation has moved on to iteration {self.sim.iters}')
+
+
+    @property
+    def Counts(self):
+        self._Check()
+        return self._Counts
+
+
+    def Fractions(self):
+        '''Returns the proportion of the population which is Susceptible, Infected, and Recovered, in that order.'''
+
+        self._Check()
+        return self.sim.Fractions()
+
+
+    @property
+    def Grid(self):
+        '''The NxN grid painted by Country.Paint.'''
+
+        self._Check()
+        sim = self.sim
+
+        if sim._Painted != self.t:
+            if sim._Grid is None or sim._Grid.shape != (sim.country.N, sim.country.N):
+                sim._Grid = np.zeros((sim.country.N, sim.country.N), dtype = np.int8)
+
+            with sim.country.profiler('Paint'):
+                sim.country.Paint(sim._Grid)
+
+            sim._Painted = self.t
+
+        Grid = sim._Grid.view()
+        Grid.flags.writeable = False
+
+        return Grid
 ##############################################################################################################
 ##############################################################################################################
 ##############################################################################################################
@@ -269,9 +1407,11 @@ class Country:
 ##############################################################################################################
 class Simulation:
 
-    def __init__(self, country, radius = 1, risk = 0.10, Infected_Iters = 100, Recovered_Iters = 1000000000, hospital_capacity = 0.40):
+    def __init__(self, country, radius = 1, risk = 0.10, Infected_Iters = 100, Recovered_Iters = 1000000000, hospital_capacity = 0.40,
+                 engine = 'agent', steady_state = None):
         '''country is a country object on which we will run the simulation. radius, risk, Infected_Iters, Recovered_Iters, and hospital_capacity are
-            all parameters for the simulation. The method Run will run the simulation.'''
+            all parameters for the simulation. The method Run will run the simulation. If steady_state (a SteadyState) is given,
+            every run stops early once it says the simulation has settled down.'''
 
         #The country in which the people live
         self.country = country
@@ -294,111 +1434,355 @@ class Simulation:
         #The hospital capacity, given as a proportion of the population
         self.hospital_capacity = hospital_capacity
 
+        #Outputs which record the simulation as it runs (see Add_Output)
+        self.outputs = []
 
-    def Run(self):
-        '''Run the simulation!!!'''
+        #The buffer the Grid of a StepView is painted into, and the iteration it was last painted on
+        self._Grid = None
+        self._Painted = None
 
-        #Create the figure
-        fig = plt.figure(figsize = (6, 4))
+        #Detects when the simulation has settled down, if given. Why and on which iteration the last run stopped are kept
+        #in stop_reason ('extinction', 'steady_state', or 'max_iters') and stop_iter.
+        self.steady_state = steady_state
+        self.stop_reason = None
+        self.stop_iter = None
 
-        #The left axis will be for plotting the distribution over time
-        #The right axis will be for plotting the people moving
-        #Below we set many features of these two axes
-        ax_Left = fig.add_subplot(121)
-        ax_Left.set_ylim([0, 1.01])
-        ax_Left.set_xlabel('Time', fontsize = 10)
-        ax_Right = fig.add_subplot(122)
-        ax_Right.set_title('The Country\nof Elbonia', fontsize = 10)
-        ax_Right.set_xticks([])
-        ax_Right.set_xticklabels([])
-        ax_Right.set_yticks([])
-        ax_Right.set_yticklabels([])
-        ax_Right.tick_params(axis=u'both', which=u'both',length=0)
-
-
-        #Colormap
-        #Let 0 be white (unoccupied), 1 be Susceptible, 2 be Infected, 3 be Recovered
-        cmap = ListedColormap(['w', 'y', 'r', 'b'])
-
-        #Dictionary for determine what number to give each cell in the grid.
-        StateDict = {'S':1, 'I':2, 'R':3}
-
-        #Initialize several data series which will be updated over time as the simulation runs
-        tData = [self.iters]
-        SData = [len([P for P in self.country.People if P.State == 'S'])/len(self.country.People)]
-        IData = [len([P for P in self.country.People if P.State == 'I'])/len(self.country.People)]
-        RData = [len([P for P in self.country.People if P.State == 'R'])/len(self.country.People)]
-        HCData = [self.hospital_capacity]
+        #How the people are simulated. With the 'aggregate' engine the Random movers are counted rather than tracked one by
+        #one (see Country.Aggregate_Random), so the cost depends on the size of the country rather than the number of them.
+        if engine not in ('agent', 'aggregate'):
+            raise ValueError(f'engine {engine} not defined!')
 
-        
+        self.engine = engine
 
+        if engine == 'aggregate':
+            country.Aggregate_Random(Infected_Iters, Recovered_Iters)
 
-        #The function below is used by FuncAnimation to update the plot each frame
-        def func(frame):
 
+    def Fractions(self):
+        '''Returns the proportion of the population which is Susceptible, Infected, and Recovered, in that order.'''
+
+        Counts = self.country.Counts.sum(axis = 1)
+        Total = Counts.sum()
+
+        return Counts[S]/Total, Counts[I]/Total, Counts[R]/Total
+
+
+    def Step(self):
+        '''Advance the simulation by a single iteration.'''
+
+        Profile = self.country.profiler
+        Profile.Tick(self.iters + 1)
+
+        with Profile('Step'):
             #Move all the people in the country
-            self.country.Move_People()
+            with Profile('Move_People'):
+                self.country.Move_People()
 
             #Update the people in the country
-            self.country.Update_People(self.risk, self.radius, self.Infected_Iters, self.Recovered_Iters)
+            with Profile('Update_People'):
+                self.country.Update_People(self.risk, self.radius, self.Infected_Iters, self.Recovered_Iters)
 
             #add one to the number of iterations
             self.iters += 1
 
-            #Update the series data that are plotted
-            tData.append(self.iters)
-            SData.append(len([P for P in self.country.People if P.State == 'S'])/len(self.country.People))
-            IData.append(len([P for P in self.country.People if P.State == 'I'])/len(self.country.People))
-            RData.append(len([P for P in self.country.People if P.State == 'R'])/len(self.country.People))
-            HCData.append(self.hospital_capacity)
+            #Pass the new state of the simulation on to the outputs
+            with Profile('Outputs'):
+                for Output in self.outputs:
+                    Output.Record(self)
+
+
+    def Iter_Steps(self, max_iters = None):
+        '''Returns an iterator which advances the simulation by one iteration every time it is advanced, and yields a
+            StepView of the simulation after it. It stops once no one is infected, once the steady_state of the
+            simulation says it has settled down, or after max_iters iterations if max_iters is given. Why and when it
+            stopped are then kept in stop_reason and stop_iter.'''
+
+        self.stop_reason = None
+        self.stop_iter = None
+
+        n = 0
+        while True:
+            if self.country.Counts[I].sum() == 0:
+                Reason = 'extinction'
+            elif self.steady_state is not None and self.steady_state.Steady():
+                Reason = 'steady_state'
+            elif max_iters is not None and n >= max_iters:
+                Reason = 'max_iters'
+            else:
+                Reason = None
+
+            if Reason is not None:
+                self.stop_reason = Reason
+                self.stop_iter = self.iters
+                return
+
+            self.Step()
+            n += 1
+
+            if self.steady_state is not None:
+                self.steady_state.Add(self.Fractions())
+
+            yield StepView(self)
+
+
+    def Add_Output(self, output):
+        '''Attach an output to the simulation, e.g. an Output.TrajectoryWriter. An output is any object with a method
+            Record, which is passed the simulation now and again after every iteration.'''
+
+        self.outputs.append(output)
+        output.Record(self)
+
 
-            #Create the grid
-            Grid = np.zeros((self.country.N, self.country.N))
+    def Save_Checkpoint(self, path):
+        '''Save the full state of the simulation to the file path: the parameters, the state, location, MoveType, and counters
+            of every person, the number of iterations, and the state of the random number generator. The file is written
+            under a temporary name and then renamed, so an existing checkpoint is never left half overwritten.'''
 
-            #For each person in the country, paint his square according to his state
-            for P in self.country.People:
-                Grid[P.Loc[0]][P.Loc[1]] = StateDict[P.State]
+        country = self.country
+        People = country.People
 
+        Parameters = {'N': country.N,
+                      'sparse_threshold': country.sparse_threshold,
+                      'compact': country.compact,
+                      'iters': self.iters,
+                      'Iteration': country.Iteration,
+                      'radius': self.radius,
+                      'risk': self.risk,
+                      'Infected_Iters': _Iters_To_JSON(self.Infected_Iters),
+                      'Recovered_Iters': _Iters_To_JSON(self.Recovered_Iters),
+                      'hospital_capacity': self.hospital_capacity,
+                      'engine': self.engine,
+                      'Pool': None if country.Pool is None else country.Pool.To_JSON(),
+                      'steady_state': None if self.steady_state is None else self.steady_state.To_JSON(),
+                      'next_id': People.next_id,
+                      'streams': None if country.streams is None else country.streams.To_JSON(),
+                      'rng': country.rng.bit_generator.state}
+
+        Arrays = {Name: getattr(People, Name) for Name in People._Buffers}
+
+        if country.Pool is not None:
+            Arrays.update({f'Pool_{State}': Cells for State, Cells in country.Pool.Cells.items()})
+
+        Temp = path + '.tmp'
+        with open(Temp, 'wb') as f:
+            np.savez(f, Parameters = np.frombuffer(json.dumps(Parameters).encode(), dtype = np.uint8), **Arrays)
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(Temp, path)
+
+
+    @classmethod
+    def Load_Checkpoint(cls, path):
+        '''Returns the Simulation saved to the file path by Save_Checkpoint. Running it continues exactly where the saved
+            simulation left off.'''
+
+        with np.load(path) as Data:
+            Parameters = json.loads(Data['Parameters'].tobytes())
+
+            country = Country(Parameters['N'], sparse_threshold = Parameters['sparse_threshold'], compact = Parameters['compact'],
+                              common_random = Parameters.get('streams') is not None)
+            People = country.People
+
+            People._Reserve(len(Data['State']))
+            People.size = len(Data['State'])
+            People._SetViews()
+
+            for Name in People._Buffers:
+                if Name in Data:
+                    getattr(People, Name)[:] = Data[Name]
+
+            #Checkpoints saved before people had IDs number them in order
+            if 'ID' not in Data:
+                People.ID[:] = np.arange(len(People))
+
+            People.next_id = Parameters.get('next_id', len(People))
+
+            #The pool is restored as it was rather than being rebuilt by the engine
+            if Parameters['Pool'] is not None:
+                country.Pool = RandomPool.From_JSON(Parameters['Pool'])
+                country.Pool.Cells = {State: Data[f'Pool_{State}'] for State in (S, I, R)}
+
+        country.Recount()
+        country.Iteration = Parameters['Iteration']
+        country.Rebuild_Schedule()
+
+        #Restore the random number generator exactly as it was
+        State = Parameters['rng']
+        country.rng = np.random.Generator(getattr(np.random, State['bit_generator'])())
+        country.rng.bit_generator.state = State
+
+        if country.common_random:
+            country.streams = CommonRandom.From_JSON(Parameters['streams'])
+
+        sim = cls(country, Parameters['radius'], Parameters['risk'], _Iters_From_JSON(Parameters['Infected_Iters']),
+                  _Iters_From_JSON(Parameters['Recovered_Iters']), Parameters['hospital_capacity'])
+        sim.iters = Parameters['iters']
+        sim.engine = Parameters['engine']
+
+        if Parameters['steady_state'] is not None:
+            sim.steady_state = SteadyState.From_JSON(Parameters['steady_state'])
+
+        return sim
+
+
+    def Run_Headless(self, max_iters, checkpoint_path = None, checkpoint_every = 1000):
+        '''Run the simulation without plotting anything, as fast as possible, until no one is infected, the simulation
+            has settled down (if it has a steady_state), or max_iters iterations have been run. Returns a dictionary of
+            NumPy arrays with one entry per iteration (including the starting point): t holds the iteration, S, I, and R
+            hold the proportion of the population in each state, and HC_Exceeded is True wherever the proportion infected
+            is above the hospital capacity. If checkpoint_path is given, a checkpoint is saved there (see Save_Checkpoint)
+            every checkpoint_every iterations and at the end, and the run can be resumed from it with Load_Checkpoint.'''
+
+        tData = np.zeros(max_iters + 1, dtype = np.int64)
+        SIRData = np.zeros((max_iters + 1, 3), dtype = np.float32)
+
+        tData[0] = self.iters
+        SIRData[0] = self.Fractions()
+
+        #Run until there are zero infected persons, or the simulation has settled down
+        n = 1
+        for View in self.Iter_Steps(max_iters):
+            tData[n] = View.t
+            SIRData[n] = View.Fractions()
+            n += 1
+
+            if checkpoint_path is not None and self.iters % checkpoint_every == 0:
+                self.Save_Checkpoint(checkpoint_path)
+
+        if checkpoint_path is not None:
+            self.Save_Checkpoint(checkpoint_path)
+
+        return {'t': tData[:n],
+                'S': SIRData[:n, 0].copy(),
+                'I': SIRData[:n, 1].copy(),
+                'R': SIRData[:n, 2].copy(),
+                'HC_Exceeded': SIRData[:n, 1] > self.hospital_capacity}
+
+
+    def Export(self, path, max_iters, stride = 1, fps = 30, directory = None, processes = None, dpi = 100):
+        '''Run the simulation for at most max_iters iterations, or until no one is infected, and write the figure Run
+            shows to a video or animated GIF at path, with a frame every stride iterations, without opening a window. See
+            Export.Export_Simulation for the rest of the arguments. Returns the number of frames written.'''
+
+        from Export import Export_Simulation
+
+        return Export_Simulation(self, path, max_iters, stride, fps, directory, processes, dpi)
+
+
+    def Run(self, interval = 25):
+        '''Run the simulation!!! The simulation runs as fast as it can on a thread of its own, while the figure is redrawn
+            with the latest iteration every interval milliseconds. The curves show every iteration, but the country
+            is only painted for the iterations which are drawn.'''
+
+        from matplotlib import pyplot as plt
+        from matplotlib import animation
+
+        #Create the figure
+        fig = plt.figure(figsize = (6, 4))
+
+        #Time every drawing of the figure as the Draw phase of the country's profiler
+        Draw = fig.draw
+        def draw(renderer):
+            with self.country.profiler('Draw'):
+                Draw(renderer)
+        fig.draw = draw
+
+        #Initialize the data series which will be updated over time as the simulation runs
+        Series = _Series((self.iters, *self.Fractions(), self.hospital_capacity))
+
+        #The simulation runs on a thread of its own, and hands frames over to the figure through these. Lock guards the
+        #series data and Grid, Wanted is set by the figure when it is ready for a new frame, and Stop tells the thread
+        #to finish early when the figure is closed.
+        Lock = threading.Lock()
+        Wanted = threading.Event()
+        Stop = threading.Event()
+        Frames = {'painted': 0, 'shown': 0, 'error': None}
+
+        #The Grid is painted into the same buffer every time
+        Grid = self.country.Paint()
+
+        #The function below steps the simulation as fast as it can, only painting the Grid when the figure wants it
+        def simulate():
+            try:
+                #Move and update all the people in the country
+                for View in self.Iter_Steps():
+                    if Stop.is_set():
+                        break
+
+                    Fractions = View.Fractions()
+
+                    with Lock:
+                        #Update the series data that are plotted
+                        Series.Append((self.iters, *Fractions, self.hospital_capacity))
+
+                        #For each person in the country, paint his square according to his state
+                        if Wanted.is_set():
+                            with self.country.profiler('Paint'):
+                                self.country.Paint(Grid)
+
+                            Frames['painted'] = self.iters
+                            Wanted.clear()
+
+                #The last iteration is always painted, so the figure ends on it
+                with Lock:
+                    self.country.Paint(Grid)
+                    Frames['painted'] = self.iters
+
+            except BaseException as Error:
+                Frames['error'] = Error
+
+
+        #The function below is used by FuncAnimation to update the plot with the latest frame
+        def func(frame):
+
+            with Lock:
+                #Set the Grid, which is copied, and take the series as they stand without copying them
+                if Frames['painted'] != Frames['shown']:
+                    mat.set_data(Grid)
+                    Frames['shown'] = Frames['painted']
+
+                Data, n = Series.Latest()
+
+                Wanted.set()
+
+            #The rows already added never change, so the curves are thinned out to about two points per pixel of the
+            #axis after the lock is let go, and however long the simulation runs only that many points are drawn
+            tData, SData, IData, RData, HCData = _Decimate(Data, n, 2*int(ax_Left.bbox.width) + 2).T
+            iters = tData[-1]
 
-            #Set the data
-            mat.set_data(Grid)
             lineS.set_data(tData, SData)
             lineI.set_data(tData, IData)
             lineR.set_data(tData, RData)
             lineHC.set_data(tData, HCData)
 
             #Update aspect ratio and xaxis limit
-            ax_Left.set_xlim([0, self.iters])
-            ax_Left.set_aspect(self.iters)
+            ax_Left.set_xlim([0, max(iters, 1)])
+            ax_Left.set_aspect(max(iters, 1))
 
-            #If there are zero infected persons, stop the simulation
-            if IData[-1] == 0:
+            #Once the simulation has stopped and its last frame is shown, stop the animation
+            if not Thread.is_alive() and Frames['painted'] == Frames['shown']:
                 ani.event_source.stop()
 
 
-        #Initialize the Grid
-        Grid = np.zeros((self.country.N, self.country.N))
-
-        #For each person in the city, paint his square according to his state
-        for P in self.country.People:
-            Grid[P.Loc[0]][P.Loc[1]] = StateDict[P.State]
-
         #Initialize the plots on the first frame
-        mat = ax_Right.matshow(Grid, cmap = cmap, vmin = 0, vmax = 3)
-        lineS, = ax_Left.plot(tData, SData, 'y', label = 'S')
-        lineI, = ax_Left.plot(tData, IData, 'r', label = 'I')
-        lineR, = ax_Left.plot(tData, IData, 'b', label = 'R')
-        lineHC, = ax_Left.plot(tData, HCData, 'k--')
+        ax_Left, mat, lineS, lineI, lineR, lineHC = Draw_Figure(fig, Grid, *Series.Data[:1].T)
 
         #Create the animation
-        ani = animation.FuncAnimation(fig, func, interval = 25, repeat = False)
-
-        #Legend
-        ax_Left.legend(loc='upper center', bbox_to_anchor=(0.5, 1.25),
-          fancybox=True, shadow=True, ncol=3, fontsize = 10)
+        ani = animation.FuncAnimation(fig, func, interval = interval, repeat = False, cache_frame_data = False)
 
         #Animate the simulation!
-        plt.show()
+        Thread = threading.Thread(target = simulate, daemon = True)
+        Thread.start()
+
+        try:
+            plt.show()
+        finally:
+            Stop.set()
+            Thread.join()
+
+        if Frames['error'] is not None:
+            raise Frames['error']
 ##############################################################################################################
 ##############################################################################################################
 ##############################################################################################################
@@ -0,0 +1,356 @@
+'''This script runs a metapopulation: several regions, each its own Simulation with its own country, mix of movers, and
+    parameters, linked by people travelling between them. The regions are split into groups, and each group is stepped
+    by a worker process of its own. The workers only talk to this process, through pipes, when migrants are exchanged.
+
+    Every interval iterations:
+        1. Each worker steps each of its regions interval times, recording the number of people in each state.
+        2. Each region picks its emigrants. Each person who may travel (by default everyone except Isolate movers)
+           leaves region a for region b with probability migration[a, b]. The emigrants are removed from their region,
+           keeping their state and how long they have left in it (see Country.Emigrate).
+        3. The emigrants are sent back to this process, which hands them to the workers of their destinations, which
+           place them at random squares of their new regions (see Country.Immigrate) before the next interval.
+
+    Every region draws its migrants from the random numbers of its own country, so a run gives the same result however
+    many workers it is split over.
+
+    Run_Metapopulation:
+        Runs a list of Simulations as a metapopulation, and returns the proportion of the population in each state
+        over time in every region and in all of them together.
+
+
+    Simply running this script will run a ring of regions, with a few infected people in the first, and report how the
+    run time changes with the number of workers.
+'''
+
+from multiprocessing import get_context, get_all_start_methods
+from time import perf_counter
+import os
+import numpy as np
+
+from InfectiousDisease import Country, Simulation, MoveTypeCodes, S, I, R
+
+
+class _Group:
+    '''The regions stepped by one worker. Regions is a list of (region number, Simulation).'''
+
+    def __init__(self, Regions, migration, Travellers):
+        self.Regions = Regions
+        self.migration = migration
+        self.Travellers = Travellers
+
+
+    def Exchange(self, Incoming, iters):
+        '''Take in the migrants Incoming (a dictionary from region number to a list of migrants), step every region iters
+            times, and pick the emigrants (unless iters is 0). Returns the counts of S, I, and R in every region after every
+            iteration as an array of shape (iters, regions, 3), and a list of (region left, destination region, migrants).'''
+
+        Counts = np.zeros((iters, len(self.Regions), 3), dtype = np.int64)
+        Outgoing = []
+
+        for j, (a, sim) in enumerate(self.Regions):
+            country = sim.country
+
+            for Migrants in Incoming.get(a, []):
+                country.Immigrate(Migrants)
+
+            for n in range(iters):
+                sim.Step()
+                Counts[n, j] = country.Counts[[S, I, R]].sum(axis = 1)
+
+            if iters > 0:
+                Outgoing += self._Emigrants(a, country)
+
+        return Counts, Outgoing
+
+
+    def _Emigrants(self, a, country):
+        #Pick the people leaving region a, and where each of them is going
+        Rates = self.migration[a].copy()
+        Rates[a] = 0
+        Leaving = Rates.sum()
+
+        if Leaving == 0:
+            return []
+
+        Eligible = np.flatnonzero(np.isin(country.People.MoveType, self.Travellers))
+        nLeaving = country.rng.binomial(len(Eligible), Leaving)
+
+        if nLeaving == 0:
+            return []
+
+        Index = np.sort(country.rng.choice(Eligible, nLeaving, replace = False))
+        Destinations = country.rng.choice(len(Rates), nLeaving, p = Rates/Leaving)
+
+        Migrants = country.Emigrate(Index)
+
+        return [(a, int(b), {Name: Values[Destinations == b] for Name, Values in Migrants.items()})
+                for b in np.unique(Destinations)]
+
+
+def _Worker(Connection, Regions, migration, Travellers):
+    '''The loop run by a worker process, which steps the regions of its _Group whenever it is told to.'''
+
+    Group = _Group(Regions, migration, Travellers)
+
+    try:
+        while True:
+            Message = Connection.recv()
+
+            #None means the run is over, so send the final state of the regions back
+            if Message is None:
+                Connection.send([sim for a, sim in Group.Regions])
+                break
+
+            Connection.send(Group.Exchange(*Message))
+
+    except BaseException as Error:
+        Connection.send(Error)
+
+    finally:
+        Connection.close()
+
+
+def _Split(Sizes, workers):
+    #Split the regions into workers groups with about as many people in each, largest regions first
+    Groups = [[] for w in range(workers)]
+    Loads = np.zeros(workers)
+
+    for a in np.argsort(Sizes, kind = 'stable')[::-1]:
+        w = np.argmin(Loads)
+        Groups[w].append(int(a))
+        Loads[w] += Sizes[a]
+
+    return [sorted(Group) for Group in Groups if Group]
+
+
+def Run_Metapopulation(regions, migration, max_iters, interval = 10, workers = None, travellers = ('Random', 'Drunkard'),
+                       steady_state = None):
+    '''Run the Simulations in regions as a metapopulation for at most max_iters iterations, until no one in any region
+        is infected, or until the proportion of the whole population in each state has settled down according to
+        steady_state (a SteadyState), if one is given. These are checked whenever migrants are exchanged, and why and
+        when the run stopped are kept in stop_reason and stop_iter of every region. migration is a square array where
+        migration[a, b] is the probability that a person who may travel leaves region a for region b at each exchange
+        (the diagonal is ignored), and migrants are exchanged every interval iterations. Only people whose MoveType is in
+        travellers may travel. The regions are spread over workers worker processes (by default one per core), or run in
+        this process if workers is 1.
+
+        The list regions is left holding the Simulations in their final state. If workers is 1 these are the same
+        Simulations, stepped in place. Otherwise they are the copies sent back by the workers, which replace the entries
+        of the list, so any other references to the original Simulations still see them as they were before the run. If
+        a worker process fails, a RuntimeError is raised from its error and the list is left as it was. With workers = 1
+        the error is raised as it is, and the regions are left wherever they had got to.
+
+        Returns a dictionary of NumPy arrays with one entry per iteration (including the starting point): t holds the
+        iteration, and S, I, and R the proportion of the whole population in each state. Region_S, Region_I, and
+        Region_R hold the same for each region, with one column per region, and Population the number of people in each
+        region.'''
+
+    nRegions = len(regions)
+    migration = np.asarray(migration, dtype = np.float64)
+
+    if migration.shape != (nRegions, nRegions):
+        raise ValueError(f'migration must be a {nRegions}x{nRegions} array')
+
+    Leaving = migration.sum(axis = 1) - np.diag(migration)
+    if migration.min() < 0 or Leaving.max(initial = 0) > 1:
+        raise ValueError('migration must hold probabilities, and no more than 1 in total may leave any region')
+
+    for sim in regions:
+        if sim.country.Pool is not None:
+            raise ValueError('Run_Metapopulation does not support the aggregate engine, since pooled people cannot travel')
+
+        if sim.country.provenance is not None:
+            raise ValueError('Run_Metapopulation does not record provenance, since people are given new IDs when they travel')
+
+        if sim.steady_state is not None:
+            raise ValueError('Run_Metapopulation watches the whole metapopulation rather than each region; pass it a steady_state')
+
+        #Decide when anyone who was just added changes state, so that it travels with them
+        sim.country.Schedule_Pending(sim.Infected_Iters, sim.Recovered_Iters)
+
+    Travellers = [MoveTypeCodes[MoveType] for MoveType in travellers]
+
+    Counts = np.zeros((max_iters + 1, nRegions, 3), dtype = np.int64)
+    Counts[0] = [sim.country.Counts[[S, I, R]].sum(axis = 1) for sim in regions]
+    tData = regions[0].iters + np.arange(max_iters + 1) if nRegions > 0 else np.arange(max_iters + 1)
+
+    Groups = _Split([len(sim.country.People) for sim in regions], min(workers or os.cpu_count(), max(nRegions, 1)))
+
+    if workers == 1:
+        Inline = _Group([(a, regions[a]) for a in Groups[0]], migration, Travellers) if Groups else None
+        Exchange = lambda w, Incoming, iters: Inline.Exchange(Incoming, iters)
+
+    else:
+        Context = get_context('fork') if 'fork' in get_all_start_methods() else get_context()
+        Connections = []
+        Processes = []
+
+        for Group in Groups:
+            Parent, Child = Context.Pipe()
+            Process = Context.Process(target = _Worker, args = (Child, [(a, regions[a]) for a in Group], migration, Travellers))
+            Process.start()
+            Child.close()
+
+            Connections.append(Parent)
+            Processes.append(Process)
+
+        def Exchange(w, Incoming, iters):
+            Connections[w].send((Incoming, iters))
+
+        def Receive():
+            #Read the reply of every worker before looking at any of them, so that none is left unread if one failed
+            Results = [Connection.recv() for Connection in Connections]
+
+            for Result in Results:
+                if isinstance(Result, BaseException):
+                    raise RuntimeError('A worker failed while running the metapopulation') from Result
+
+            return Results
+
+    Finished = False
+
+    try:
+        n = 0
+        Incoming = {}
+
+        while True:
+            #Stop for the same reasons, checked in the same order, as Simulation.Iter_Steps, counting the migrants on their
+            #way as well
+            Infected = Counts[n, :, 1].sum() + sum(int(np.count_nonzero(Migrants['State'] == I))
+                                                   for Arrivals in Incoming.values() for Migrants in Arrivals)
+
+            if Infected == 0:
+                Reason = 'extinction'
+            elif steady_state is not None and steady_state.Steady():
+                Reason = 'steady_state'
+            elif n >= max_iters:
+                Reason = 'max_iters'
+            else:
+                Reason = None
+
+            if Reason is not None:
+                break
+
+            iters = min(interval, max_iters - n)
+
+            #Start every worker on the interval before waiting for any of them
+            Results = [Exchange(w, {a: Incoming[a] for a in Group if a in Incoming}, iters) for w, Group in enumerate(Groups)]
+
+            if workers != 1:
+                Results = Receive()
+
+            #Gather the counts, and route the emigrants to their destinations in the order of the regions they left
+            Incoming = {}
+            Outgoing = []
+
+            for Group, (GroupCounts, GroupOutgoing) in zip(Groups, Results):
+                Counts[n+1:n+1+iters, Group] = GroupCounts
+                Outgoing += GroupOutgoing
+
+            for a, b, Migrants in sorted(Outgoing, key = lambda Emigrants: Emigrants[0]):
+                Incoming.setdefault(b, []).append(Migrants)
+
+            #Pass the proportions of the whole population after each iteration to steady_state
+            if steady_state is not None:
+                for Total in Counts[n+1:n+1+iters].sum(axis = 1):
+                    steady_state.Add(Total/Total.sum())
+
+            n += iters
+
+        #Put the migrants still on their way into their destinations, so no one is lost
+        if Incoming:
+            Results = [Exchange(w, {a: Incoming[a] for a in Group if a in Incoming}, 0) for w, Group in enumerate(Groups)]
+
+            if workers != 1:
+                Results = Receive()
+
+        if workers != 1:
+            #Collect the final state of the regions from the workers
+            for Connection in Connections:
+                Connection.send(None)
+
+            Final = Receive()
+
+        Finished = True
+
+    finally:
+        if workers != 1:
+            #If something went wrong, the workers are stopped wherever they are and their regions thrown away
+            if not Finished:
+                for Process in Processes:
+                    Process.terminate()
+
+            for Connection in Connections:
+                Connection.close()
+
+            for Process in Processes:
+                Process.join()
+
+    #Only hand the regions over once every worker has sent its own back
+    if workers != 1:
+        for Group, Sims in zip(Groups, Final):
+            for a, sim in zip(Group, Sims):
+                regions[a] = sim
+
+    for sim in regions:
+        sim.stop_reason = Reason
+        sim.stop_iter = tData[n]
+
+    Counts = Counts[:n+1]
+    Population = Counts.sum(axis = 2)
+    Total = Population.sum(axis = 1)
+
+    return {'t': tData[:n+1],
+            'S': Counts[:, :, 0].sum(axis = 1)/Total,
+            'I': Counts[:, :, 1].sum(axis = 1)/Total,
+            'R': Counts[:, :, 2].sum(axis = 1)/Total,
+            'Region_S': Counts[:, :, 0]/np.maximum(Population, 1),
+            'Region_I': Counts[:, :, 1]/np.maximum(Population, 1),
+            'Region_R': Counts[:, :, 2]/np.maximum(Population, 1),
+            'Population': Population}
+
+
+
+
+if __name__ == '__main__':
+
+    #A ring of regions, each a small country like VeryFewTravelersWithIsolation.py, where each person who may travel
+    #moves to one of the neighboring regions with a small probability
+    nRegions = 200
+    Iters = 200
+
+    def Build():
+        Regions = []
+
+        for a in range(nRegions):
+            country = Country(N = 100, seed = [0, a])
+            country.Add_Population(2250, 'S', MoveType = 'Drunkard')
+            country.Add_Population(2250, 'S', MoveType = 'Isolate')
+            country.Add_Population(500, 'S', MoveType = 'Random')
+
+            if a == 0:
+                country.Add_Population(10, 'I', MoveType = 'Drunkard')
+
+            Regions.append(Simulation(country, radius = 1, risk = 0.10, Infected_Iters = 100))
+
+        Migration = np.zeros((nRegions, nRegions))
+        for a in range(nRegions):
+            Migration[a, (a - 1) % nRegions] = Migration[a, (a + 1) % nRegions] = 0.001
+
+        return Regions, Migration
+
+    print(f'{nRegions} regions of 5000 people, {Iters} iterations ({os.cpu_count()} cores available)')
+    print('workers   seconds   speedup   regions reached   infected')
+
+    for workers in (1, 2, 4, 8):
+        Regions, Migration = Build()
+
+        Start = perf_counter()
+        Result = Run_Metapopulation(Regions, Migration, Iters, interval = 10, workers = workers)
+        Time = perf_counter() - Start
+
+        if workers == 1:
+            Base = Time
+
+        Reached = np.count_nonzero(Result['Region_S'][-1] < 1)
+        print(f'{workers:7d} {Time:9.2f} {Base/Time:9.2f} {Reached:17d} {Result["I"][-1]:10.4f}')
@@ -0,0 +1,305 @@
+'''This script contains outputs which record a simulation to disk as it runs, and a reader for what they record.
+    An output is attached to a simulation with Simulation.Add_Output, after which it is passed the simulation after
+    every iteration.
+
+    TrajectoryWriter:
+        Streams the number of people in each state after every iteration, and optionally a snapshot of the grid every
+        few iterations, into a directory. The data are written in chunks through memory-mapped files, so only one chunk
+        of each is ever held in memory no matter how long the simulation runs.
+
+    TrajectoryReader:
+        Opens a directory written by a TrajectoryWriter. The data are memory-mapped rather than read, so even very long
+        runs open instantly and only the parts which are used are loaded.
+
+
+    The files in a directory are:
+        meta.json       - the size of the country, the snapshot stride, and how much has been written
+        counts.bin      - int64 rows of (iteration, S, I, R)
+        snapshots.bin   - int8 NxN grids of state codes, as painted by Country.Paint
+        snapshot_t.bin  - int64 iteration of each snapshot
+
+
+    Simply running this script will record the worst-case scenario and read it back.
+'''
+
+import json
+import os
+import numpy as np
+
+from InfectiousDisease import Country, Simulation
+
+
+class ChunkedArray:
+
+    def __init__(self, path, shape, dtype, chunk = 4096):
+        '''An array of rows of the given shape and dtype, stored in the file path, which grows one row at a time. The file
+            is extended chunk rows at a time and only the current chunk is memory-mapped. Existing rows in the file are
+            discarded.'''
+
+        self.path = path
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.chunk = chunk
+
+        #The number of rows written, and the chunk currently mapped
+        self.size = 0
+        self.Map = None
+        self.Start = 0
+
+        self.RowBytes = int(np.prod(self.shape))*self.dtype.itemsize
+
+        open(path, 'wb').close()
+
+
+    def _Map_Next(self):
+        #Make room for the next chunk in the file, then map it
+        self.Flush()
+        self.Map = None
+
+        with open(self.path, 'r+b') as f:
+            f.truncate((self.size + self.chunk)*self.RowBytes)
+
+        self.Start = self.size
+        self.Map = np.memmap(self.path, dtype = self.dtype, mode = 'r+', offset = self.Start*self.RowBytes,
+                             shape = (self.chunk,) + self.shape)
+
+
+    def Next(self):
+        '''Add a row to the end of the array, and return it so that it can be filled in place.'''
+
+        if self.Map is None or self.size - self.Start == self.chunk:
+            self._Map_Next()
+
+        self.size += 1
+
+        #Slicing rather than indexing gives a view even when the rows are single numbers
+        i = self.size - 1 - self.Start
+
+        return self.Map[i:i+1].reshape(self.shape)
+
+
+    def Append(self, row):
+        '''Add a row to the end of the array.'''
+
+        self.Next()[...] = row
+
+
+    def Extend(self, rows):
+        '''Add several rows to the end of the array at once, as an array with one more dimension than a row.'''
+
+        Done = 0
+
+        while Done < len(rows):
+            if self.Map is None or self.size - self.Start == self.chunk:
+                self._Map_Next()
+
+            #Fill as much of the current chunk as the rows allow
+            i = self.size - self.Start
+            n = min(self.chunk - i, len(rows) - Done)
+            self.Map[i:i+n] = rows[Done:Done+n]
+
+            self.size += n
+            Done += n
+
+
+    def Flush(self):
+        if self.Map is not None:
+            self.Map.flush()
+
+
+    def Close(self):
+        '''Write out the current chunk, and trim the file to the rows actually written.'''
+
+        self.Flush()
+        self.Map = None
+
+        with open(self.path, 'r+b') as f:
+            f.truncate(self.size*self.RowBytes)
+
+
+
+
+##############################################################################################################
+##############################################################################################################
+##############################################################################################################
+class TrajectoryWriter:
+
+    def __init__(self, directory, snapshot_stride = None, chunk = 4096):
+        '''directory is where the run is recorded, and is created if needed. If snapshot_stride is given, the grid is
+            recorded whenever the iteration is a multiple of it. chunk is the number of iterations (or snapshots) written
+            through each memory map.'''
+
+        self.directory = directory
+        self.snapshot_stride = snapshot_stride
+        self.chunk = chunk
+
+        os.makedirs(directory, exist_ok = True)
+
+        self.Counts = ChunkedArray(os.path.join(directory, 'counts.bin'), (4,), np.int64, chunk)
+        self.Snapshots = None
+        self.Snapshot_t = None
+        self.N = None
+        self.Last_Snapshot = None
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.Close()
+
+
+    def Record(self, sim):
+        '''Record the current state of the Simulation sim.'''
+
+        country = sim.country
+
+        self.Counts.Append((sim.iters, country.Count('S'), country.Count('I'), country.Count('R')))
+
+        if self.snapshot_stride and sim.iters % self.snapshot_stride == 0:
+            self.Snapshot(sim)
+
+        #Keep the metadata current whenever a chunk fills up, so a crashed run can still be read
+        if self.Counts.size % self.chunk == 0:
+            self.Flush()
+
+
+    def Snapshot(self, sim):
+        '''Record the grid of the Simulation sim, whether or not the iteration is a multiple of snapshot_stride, unless it
+            was already recorded at this iteration.'''
+
+        country = sim.country
+
+        if self.Last_Snapshot == sim.iters:
+            return
+
+        if self.Snapshots is None:
+            #Snapshots are big, so map fewer of them at a time
+            self.N = country.N
+            chunk = max(1, min(self.chunk, 2**26//self.N**2))
+            self.Snapshots = ChunkedArray(os.path.join(self.directory, 'snapshots.bin'), (self.N, self.N), np.int8, chunk)
+            self.Snapshot_t = ChunkedArray(os.path.join(self.directory, 'snapshot_t.bin'), (), np.int64, self.chunk)
+
+        #Paint straight into the memory map
+        country.Paint(self.Snapshots.Next())
+        self.Snapshot_t.Append(sim.iters)
+        self.Last_Snapshot = sim.iters
+
+
+    def Flush(self):
+        '''Write everything recorded so far to disk.'''
+
+        for Array in (self.Counts, self.Snapshots, self.Snapshot_t):
+            if Array is not None:
+                Array.Flush()
+
+        Meta = {'N': self.N,
+                'snapshot_stride': self.snapshot_stride,
+                'ticks': self.Counts.size,
+                'snapshots': 0 if self.Snapshots is None else self.Snapshots.size}
+
+        Temp = os.path.join(self.directory, 'meta.json.tmp')
+        with open(Temp, 'w') as f:
+            json.dump(Meta, f)
+
+        os.replace(Temp, os.path.join(self.directory, 'meta.json'))
+
+
+    def Close(self):
+        '''Finish writing the recording.'''
+
+        self.Flush()
+
+        for Array in (self.Counts, self.Snapshots, self.Snapshot_t):
+            if Array is not None:
+                Array.Close()
+##############################################################################################################
+##############################################################################################################
+##############################################################################################################
+
+
+
+
+##############################################################################################################
+##############################################################################################################
+##############################################################################################################
+class TrajectoryReader:
+
+    def __init__(self, directory):
+        '''Open the recording in directory. Nothing is read until it is used. The attributes t, S, I, and R are arrays
+            of the iteration and the number of people in each state, and snapshots is an array of the recorded grids
+            whose iterations are in snapshot_t.'''
+
+        with open(os.path.join(directory, 'meta.json')) as f:
+            self.meta = json.load(f)
+
+        self.N = self.meta['N']
+
+        Counts = self._Open(os.path.join(directory, 'counts.bin'), np.int64, (self.meta['ticks'], 4))
+        self.t, self.S, self.I, self.R = Counts.T
+
+        if self.meta['snapshots'] > 0:
+            self.snapshots = self._Open(os.path.join(directory, 'snapshots.bin'), np.int8, (self.meta['snapshots'], self.N, self.N))
+            self.snapshot_t = self._Open(os.path.join(directory, 'snapshot_t.bin'), np.int64, (self.meta['snapshots'],))
+        else:
+            self.snapshots = np.zeros((0, 0, 0), dtype = np.int8)
+            self.snapshot_t = np.zeros(0, dtype = np.int64)
+
+
+    def _Open(self, path, dtype, shape):
+        if shape[0] == 0:
+            return np.zeros(shape, dtype = dtype)
+
+        return np.memmap(path, dtype = dtype, mode = 'r', shape = shape)
+
+
+    def __len__(self):
+        return len(self.t)
+
+
+    def Fractions(self):
+        '''Returns the proportion of the population in each state over time, as three arrays S, I, and R.'''
+
+        Total = self.S + self.I + self.R
+
+        return self.S/Total, self.I/Total, self.R/Total
+
+
+    def Snapshot(self, t):
+        '''Returns the grid recorded at the last snapshot at or before iteration t.'''
+
+        n = np.searchsorted(self.snapshot_t, t, side = 'right') - 1
+
+        if n < 0:
+            raise ValueError(f'No snapshot at or before iteration {t}')
+
+        return self.snapshots[n]
+##############################################################################################################
+##############################################################################################################
+##############################################################################################################
+
+
+
+
+if __name__ == '__main__':
+
+    #Record the worst-case scenario, with a snapshot every 10 iterations
+    country = Country(N = 100)
+
+    for i in range(500):
+        country.Add_Person('S', MoveType = 'Random')
+
+    country.Add_Person('I', MoveType = 'Random')
+
+    Sim = Simulation(country, radius = 1, risk = 0.10, Infected_Iters = 100)
+
+    with TrajectoryWriter('WorstCaseScenario_Run', snapshot_stride = 10) as Writer:
+        Sim.Add_Output(Writer)
+        Sim.Run_Headless(1000)
+
+    Run = TrajectoryReader('WorstCaseScenario_Run')
+    S, I, R = Run.Fractions()
+
+    print(f'Recorded {len(Run)} iterations and {len(Run.snapshot_t)} snapshots')
+    print(f'Peak infected: {I.max():.3f} at iteration {Run.t[np.argmax(I)]}')
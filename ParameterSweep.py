@@ -0,0 +1,228 @@
+'''This script sweeps a simulation over a grid of parameters, running the points of the grid across a pool of
+    processes, and keeps the result of every point in a cache on disk. Re-running a sweep which overlaps one which
+    has already been run (or which was interrupted part way through) only runs the points which are missing.
+
+    A scenario is described by a configuration, which is a dictionary holding everything needed to build the
+    simulation: the size N of the country, the Population as a list of [State, count, MoveType] entries, and the
+    parameters radius, risk, Infected_Iters, Recovered_Iters, hospital_capacity, and engine of the Simulation. Any of
+    these may be swept, including the Population. steady_state, if not None, is the [window, tolerance, patience] of a
+    SteadyState which stops each run once it has settled down. If common_random is True, the country draws from common
+    random numbers (see InfectiousDisease.CommonRandom), so that points of the sweep run with the same seed are paired.
+
+    Build_Simulation:
+        Builds the Simulation described by a configuration, with its random numbers initialized from a seed.
+
+    ResultCache:
+        A directory of results, each stored under a hash of the configuration, seed, and number of iterations which
+        produced it. When the total size of the cache goes above its limit, the least recently used results are
+        deleted.
+
+    Run_Sweep:
+        Runs every point of a parameter grid, using the cache wherever possible.
+
+
+    Simply running this script will sweep the risk and radius of the worst-case scenario.
+'''
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from hashlib import sha256
+from itertools import product
+import json
+import os
+import numpy as np
+
+from InfectiousDisease import Country, Simulation, SteadyState
+
+
+#Bump this whenever a change to the model makes previously cached results invalid
+CACHE_VERSION = 2
+
+#The configuration of the worst-case scenario, which sweeps start from by default
+DEFAULT_CONFIG = {'N': 100,
+                  'Population': [['S', 500, 'Random'], ['I', 1, 'Random']],
+                  'radius': 1,
+                  'risk': 0.10,
+                  'Infected_Iters': 100,
+                  'Recovered_Iters': 1000000000,
+                  'hospital_capacity': 0.40,
+                  'engine': 'agent',
+                  'steady_state': None,
+                  'common_random': False}
+
+
+def Build_Simulation(config, seed = None):
+    '''Build the Simulation described by config (see DEFAULT_CONFIG for an example). Entries missing from config
+        are taken from DEFAULT_CONFIG.'''
+
+    config = {**DEFAULT_CONFIG, **config}
+
+    country = Country(N = config['N'], seed = seed, common_random = config['common_random'])
+
+    for State, count, MoveType in config['Population']:
+        country.Add_Population(count, State, MoveType)
+
+    steady_state = None if config['steady_state'] is None else SteadyState(*config['steady_state'])
+
+    return Simulation(country, config['radius'], config['risk'], config['Infected_Iters'],
+                      config['Recovered_Iters'], config['hospital_capacity'], config['engine'], steady_state)
+
+
+def Config_Key(config, seed, max_iters):
+    '''Returns the hash under which the result of running config with the given seed for max_iters iterations is stored.'''
+
+    config = {**DEFAULT_CONFIG, **config}
+
+    #numpy scalars are converted to plain numbers so that, e.g., 0.1 and np.float64(0.1) give the same key
+    Text = json.dumps([CACHE_VERSION, config, seed, max_iters], sort_keys = True,
+                      default = lambda x: x.item() if isinstance(x, np.generic) else str(x))
+
+    return sha256(Text.encode()).hexdigest()
+
+
+
+
+##############################################################################################################
+##############################################################################################################
+##############################################################################################################
+class ResultCache:
+
+    def __init__(self, directory, max_bytes = 2**30):
+        '''directory is where the results are stored, and is created if needed. max_bytes is the largest total size
+            the results may take up before the least recently used ones are deleted.'''
+
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+        os.makedirs(directory, exist_ok = True)
+
+        #Keep a running total of the size of the cache so it only has to be measured once
+        self.size = sum(os.path.getsize(Path) for Path in self._Files())
+
+
+    def _Files(self):
+        return [os.path.join(self.directory, Name) for Name in os.listdir(self.directory) if Name.endswith('.npz')]
+
+
+    def _Path(self, key):
+        return os.path.join(self.directory, key + '.npz')
+
+
+    def Get(self, key):
+        '''Returns the result stored under key, or None if there is none.'''
+
+        Path = self._Path(key)
+
+        try:
+            with np.load(Path) as Data:
+                Result = {Name: Data[Name] for Name in Data.files}
+        except (FileNotFoundError, OSError, ValueError):
+            return None
+
+        #Mark the result as recently used
+        os.utime(Path)
+
+        return Result
+
+
+    def Put(self, key, result):
+        '''Store result (a dictionary of NumPy arrays) under key, then delete old results if the cache is too big.'''
+
+        Path = self._Path(key)
+
+        #Write to a temporary file first so that an interrupted write never leaves a broken result behind
+        Temp = Path + '.tmp'
+        with open(Temp, 'wb') as f:
+            np.savez(f, **result)
+
+        if os.path.exists(Path):
+            self.size -= os.path.getsize(Path)
+
+        os.replace(Temp, Path)
+        self.size += os.path.getsize(Path)
+
+        self.Evict()
+
+
+    def Evict(self):
+        '''Delete the least recently used results until the cache fits within max_bytes.'''
+
+        if self.size <= self.max_bytes:
+            return
+
+        for Path in sorted(self._Files(), key = os.path.getmtime):
+            self.size -= os.path.getsize(Path)
+            os.remove(Path)
+
+            if self.size <= self.max_bytes:
+                break
+##############################################################################################################
+##############################################################################################################
+##############################################################################################################
+
+
+
+
+def _Run_Point(config, seed, max_iters):
+    return Build_Simulation(config, seed).Run_Headless(max_iters)
+
+
+def Run_Sweep(grid, max_iters, base = None, seed = 0, replicates = 1, cache_dir = 'SweepCache', max_bytes = 2**30,
+              processes = None):
+    '''Run every combination of the values in grid, a dictionary mapping configuration entries to lists of values,
+        on top of the configuration base (DEFAULT_CONFIG by default). Each point is run replicates times for at most
+        max_iters iterations with Simulation.Run_Headless, and replicate r of every point uses the seed [seed, r]. Points
+        already in the cache in cache_dir are not run again. The remaining points are spread over processes worker
+        processes (by default one per core), or run in this process if processes is 1.
+
+        Returns a list with one entry per point, in the order of the grid, each a tuple of the configuration of that
+        point and a list of the results of its replicates.'''
+
+    base = {**DEFAULT_CONFIG, **(base or {})}
+    Cache = ResultCache(cache_dir, max_bytes)
+
+    #Every configuration in the grid
+    Names = list(grid)
+    Configs = [{**base, **dict(zip(Names, Values))} for Values in product(*(grid[Name] for Name in Names))]
+
+    #Look up every run in the cache, and collect the ones which are missing
+    Results = [[None]*replicates for Config in Configs]
+    Missing = []
+
+    for n, Config in enumerate(Configs):
+        for r in range(replicates):
+            Key = Config_Key(Config, [seed, r], max_iters)
+            Results[n][r] = Cache.Get(Key)
+
+            if Results[n][r] is None:
+                Missing.append((n, r, Key))
+
+    #Run the missing points, storing each one as soon as it is done so an interrupted sweep loses little
+    if processes == 1:
+        for n, r, Key in Missing:
+            Results[n][r] = _Run_Point(Configs[n], [seed, r], max_iters)
+            Cache.Put(Key, Results[n][r])
+
+    elif len(Missing) > 0:
+        with ProcessPoolExecutor(processes) as Pool:
+            Futures = {Pool.submit(_Run_Point, Configs[n], [seed, r], max_iters): (n, r, Key) for n, r, Key in Missing}
+
+            for Future in as_completed(Futures):
+                n, r, Key = Futures[Future]
+                Results[n][r] = Future.result()
+                Cache.Put(Key, Results[n][r])
+
+    return list(zip(Configs, Results))
+
+
+
+
+if __name__ == '__main__':
+
+    Grid = {'risk': [0.05, 0.075, 0.10], 'radius': [1, 2]}
+
+    Sweep = Run_Sweep(Grid, max_iters = 1000)
+
+    print('risk   radius   peak I   final R')
+    for Config, Results in Sweep:
+        Result = Results[0]
+        print(f"{Config['risk']:5.3f} {Config['radius']:7d} {Result['I'].max():8.3f} {Result['R'][-1]:9.3f}")
@@ -0,0 +1,231 @@
+'''This script contains profilers which record how long each phase of a simulation takes. Every Country has a profiler,
+    and the Country and Simulation wrap each phase of an iteration in it:
+
+        with country.profiler('Move_People'):
+            ...
+
+    The phases are:
+        Step            - a whole iteration of Simulation.Step
+        Move_People     - moving everyone (Country.Move_People)
+        Update_People   - updating everyone's state (Country.Update_People), which is made up of
+            Schedule        - finding the people who are due to change state
+            Neighbors       - counting the infected neighbors of the susceptible persons
+            Transition      - changing the state of the people, and putting them on the Schedule
+            Pool            - updating the Random movers held in a RandomPool
+            Provenance      - finding who infected each newly infected person, if the country records it
+        Outputs         - passing the simulation on to its outputs
+        Paint           - painting the grid in Simulation.Run
+        Draw            - matplotlib drawing the figure in Simulation.Run
+
+    NullProfiler:
+        The profiler every country starts with. It records nothing, and costs next to nothing.
+
+    Profiler:
+        Records the wall time of every phase of every iteration, and optionally the memory allocated during it using
+        tracemalloc. It can print a summary table, and export a trace which can be opened in chrome://tracing or Perfetto.
+
+
+    Simply running this script will profile the worst-case scenario and print the summary.
+'''
+
+from time import perf_counter
+import json
+import threading
+import tracemalloc
+
+
+class _NullPhase:
+    #A phase which does nothing when entered or left
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+_NULL_PHASE = _NullPhase()
+
+
+class NullProfiler:
+    '''A profiler which records nothing. Entering one of its phases costs about as much as an empty with statement.'''
+
+    enabled = False
+
+    def __call__(self, name):
+        return _NULL_PHASE
+
+    def Tick(self, t):
+        pass
+
+
+
+
+##############################################################################################################
+##############################################################################################################
+##############################################################################################################
+class _Phase:
+    #One timed phase of a Profiler, entered with a with statement
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.profiler._Begin(self.name)
+        return self
+
+    def __exit__(self, *args):
+        self.profiler._End()
+        return False
+
+
+class Profiler:
+
+    def __init__(self, allocations = False):
+        '''Records every phase entered through it. If allocations is True, the peak memory allocated during each phase
+            (above what was allocated when it started) is also recorded using tracemalloc. This makes everything
+            several times slower, so the timings should be taken from a run without it. The peak is shared by every
+            thread, so phases which overlap on different threads share their peaks.'''
+
+        self.allocations = allocations
+        self.enabled = True
+
+        #One (name, iteration, start, seconds, peak bytes, thread) per phase entered
+        self.Events = []
+
+        #The phases currently entered on each thread, innermost last, as [name, start, bytes at start, peak bytes of inner
+        #phases]. Simulation.Run steps the simulation on one thread and draws it on another.
+        self._Local = threading.local()
+
+        self.t = 0
+        self.Origin = perf_counter()
+
+        if allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+
+    def __call__(self, name):
+        return _Phase(self, name)
+
+
+    def Tick(self, t):
+        '''Set the iteration which the following phases belong to.'''
+
+        self.t = t
+
+
+    @property
+    def _Stack(self):
+        if not hasattr(self._Local, 'Stack'):
+            self._Local.Stack = []
+
+        return self._Local.Stack
+
+
+    def _Begin(self, name):
+        Stack = self._Stack
+        Current = 0
+
+        if self.allocations:
+            Current, Peak = tracemalloc.get_traced_memory()
+
+            #The peak reached so far belongs to the phase this one is inside of
+            if Stack:
+                Stack[-1][3] = max(Stack[-1][3], Peak)
+
+            tracemalloc.reset_peak()
+
+        Stack.append([name, perf_counter(), Current, 0])
+
+
+    def _End(self):
+        End = perf_counter()
+        Stack = self._Stack
+        name, Start, Current, InnerPeak = Stack.pop()
+
+        Bytes = 0
+        if self.allocations:
+            Peak = max(tracemalloc.get_traced_memory()[1], InnerPeak)
+            Bytes = Peak - Current
+
+            #This peak was also reached inside the phase this one is inside of
+            if Stack:
+                Stack[-1][3] = max(Stack[-1][3], Peak)
+
+        self.Events.append((name, self.t, Start - self.Origin, End - Start, Bytes, threading.get_ident()))
+
+
+    def Stop(self):
+        '''Stop tracing memory allocations, if this profiler started it.'''
+
+        if self.allocations and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+
+    def Summary(self):
+        '''Returns a list with one entry per phase, in order of total time, of (name, calls, total seconds, mean seconds,
+            max seconds, max peak bytes).'''
+
+        Phases = {}
+
+        for name, t, Start, Seconds, Bytes, Thread in self.Events:
+            Calls, Total, Max, MaxBytes = Phases.get(name, (0, 0.0, 0.0, 0))
+            Phases[name] = (Calls + 1, Total + Seconds, max(Max, Seconds), max(MaxBytes, Bytes))
+
+        Results = [(name, Calls, Total, Total/Calls, Max, MaxBytes) for name, (Calls, Total, Max, MaxBytes) in Phases.items()]
+
+        return sorted(Results, key = lambda Result: -Result[2])
+
+
+    def Table(self):
+        '''Returns the Summary as a table which can be printed.'''
+
+        Lines = ['phase                calls    total (s)    mean (ms)     max (ms)   peak (MB)']
+
+        for name, Calls, Total, Mean, Max, MaxBytes in self.Summary():
+            Peak = f'{MaxBytes/2**20:11.2f}' if self.allocations else f'{"-":>11}'
+            Lines.append(f'{name:16} {Calls:9d} {Total:12.4f} {Mean*1e3:12.4f} {Max*1e3:12.4f} {Peak}')
+
+        return '\n'.join(Lines)
+
+
+    def Export_Trace(self, path):
+        '''Write every recorded phase to the file path in the Chrome trace event format.'''
+
+        #Number the threads in the order they first appear
+        Threads = {}
+        for Event in self.Events:
+            Threads.setdefault(Event[5], len(Threads))
+
+        Events = [{'name': name, 'ph': 'X', 'pid': 0, 'tid': Threads[Thread], 'ts': Start*1e6, 'dur': Seconds*1e6,
+                   'args': {'iteration': t, 'peak_bytes': Bytes}}
+                  for name, t, Start, Seconds, Bytes, Thread in self.Events]
+
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': Events, 'displayTimeUnit': 'ms'}, f)
+##############################################################################################################
+##############################################################################################################
+##############################################################################################################
+
+
+
+
+if __name__ == '__main__':
+
+    from InfectiousDisease import Country, Simulation
+
+    #The worst-case scenario, in a larger country
+    country = Country(N = 1000, seed = 0)
+    country.Add_Population(500000, 'S', MoveType = 'Random')
+    country.Add_Population(10, 'I', MoveType = 'Random')
+
+    country.profiler = Profiler()
+
+    Sim = Simulation(country, radius = 1, risk = 0.10, Infected_Iters = 100)
+    Sim.Run_Headless(200)
+
+    print(country.profiler.Table())
+
+    country.profiler.Export_Trace('WorstCaseScenario_Trace.json')
+    print('Trace written to WorstCaseScenario_Trace.json')
@@ -0,0 +1,269 @@
+'''This script records who infected whom. A country only knows how many infected persons are in the Moore Neighborhood
+    of each susceptible person, which is all it needs to decide who becomes infected. When a TransmissionWriter is given
+    to a country as its provenance, every person who becomes infected is also traced back to one of those infected
+    neighbors, and the pair is streamed to disk:
+
+        country.provenance = TransmissionWriter('Transmissions.bin')
+
+    Since a susceptible person with nI infected neighbors becomes infected with probability nI*risk, each neighbor is
+    equally likely to be the one who passed it on, so the infector is drawn uniformly from the infected neighbors. This is
+    done with a random number generator of its own, so recording the provenance does not change the simulation.
+
+    Occupancy:
+        An index from each square of the country to the people standing on it, rebuilt every iteration.
+
+    TransmissionWriter:
+        Finds the infector of every newly infected person, and streams (iteration, infector ID, infectee ID) to a file
+        through an Output.ChunkedArray. The number of infections written is kept in a small JSON file alongside it
+        (the same path followed by .json), which is updated whenever the writer is flushed or a chunk fills up.
+
+    TransmissionReader:
+        Opens a file written by a TransmissionWriter, memory-mapped so that even very large files open instantly. Only
+        the infections counted in the JSON file are read, so a file which is still being written, or whose run crashed,
+        can be read as well.
+
+
+    People are identified by their Population ID, which never changes. Infected persons in the RandomPool of a country
+    have no ID, so an infector in the Pool is recorded as -1, and infections within the Pool are not recorded at all.
+
+
+    Simply running this script will run the worst-case scenario with a million people, with and without recording the
+    provenance, and report the cost of recording it along with the people who infected the most others.
+'''
+
+from time import perf_counter
+import json
+import os
+import numpy as np
+
+from InfectiousDisease import Country, Simulation, I
+from Output import ChunkedArray
+
+
+class Occupancy:
+
+    def __init__(self, Index, Row, Col, N):
+        '''An index of the people with the given indices, standing at the given rows and columns of an NxN country, by the
+            square they are standing on. The squares (as row*N + column) are sorted with a stable sort, so the people
+            standing on each square are kept together, in the order of their indices.'''
+
+        Squares = Row.astype(np.int64)*N + Col
+        Order = np.argsort(Squares, kind = 'stable')
+
+        self.Squares = Squares[Order]
+        self.People = Index[Order]
+
+
+    def Find(self, Squares):
+        '''Returns where the people standing on each of Squares start in People, and how many there are.'''
+
+        Start = np.searchsorted(self.Squares, Squares, side = 'left')
+        End = np.searchsorted(self.Squares, Squares, side = 'right')
+
+        return Start, End - Start
+
+
+    def Standing_On(self, Square):
+        '''Returns the indices of the people standing on Square.'''
+
+        Start, Count = self.Find(Square)
+
+        return self.People[Start:Start+Count]
+
+
+
+
+##############################################################################################################
+##############################################################################################################
+##############################################################################################################
+class TransmissionWriter:
+
+    def __init__(self, path, seed = None, chunk = 2**16):
+        '''Record every infection to the file path, as int64 rows of (iteration, infector ID, infectee ID). seed initializes
+            the random number generator used to choose between the infected neighbors of each newly infected person.
+            chunk is the number of rows written through each memory map.'''
+
+        self.path = path
+        self.chunk = chunk
+        self.rng = np.random.default_rng(seed)
+        self.Edges = ChunkedArray(path, (3,), np.int64, chunk)
+
+        #The file is padded out to a whole chunk as it grows, so the number of infections is recorded from the start
+        self._Write_Count()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.Close()
+
+
+    def __len__(self):
+        return self.Edges.size
+
+
+    def Record(self, country, Infected, Infectees, radius):
+        '''Record who infected each of the Infectees, the indices of the people just infected, given the indices of the
+            Infected persons they could have caught it from. This is called by Country.Update_People.'''
+
+        if len(Infectees) == 0:
+            return
+
+        People = country.People
+        Index = Occupancy(Infected, People.Row[Infected], People.Col[Infected], country.N)
+
+        #Only a block of infectees is looked at at a time, so the windows of a large outbreak do not take up much memory
+        Width = (2*radius + 1)**2
+        Block = max(1, 2**20//Width)
+        Chunks = self.Edges.size//self.chunk
+
+        for Start in range(0, len(Infectees), Block):
+            Block_Infectees = Infectees[Start:Start+Block]
+            Infectors = self._Infectors(country, Index, Block_Infectees, radius)
+
+            Rows = np.empty((len(Block_Infectees), 3), dtype = np.int64)
+            Rows[:, 0] = country.Iteration
+            Rows[:, 1] = Infectors
+            Rows[:, 2] = People.ID[Block_Infectees]
+
+            self.Edges.Extend(Rows)
+
+        #Keep the count current whenever a chunk fills up, so a crashed run can still be read
+        if self.Edges.size//self.chunk > Chunks:
+            self.Flush()
+
+
+    def _Infectors(self, country, Index, Infectees, radius):
+        #Choose one infected neighbor of each infectee, and return their IDs (-1 for someone in the Pool)
+        People = country.People
+        N = country.N
+        Offsets = np.arange(-radius, radius + 1)
+        Rows = np.arange(len(Infectees))
+
+        #The squares in the Moore Neighborhood of each infectee, one row per infectee
+        Neighborhood_Rows = (People.Row[Infectees].astype(np.int64)[:, None] + Offsets) % N
+        Neighborhood_Cols = (People.Col[Infectees].astype(np.int64)[:, None] + Offsets) % N
+        Squares = (Neighborhood_Rows[:, :, None]*N + Neighborhood_Cols[:, None, :]).reshape(len(Infectees), -1)
+
+        #The number of infected persons on each of those squares, counting the Pool as well
+        Starts, Counts = Index.Find(Squares)
+        Total = Counts if country.Pool is None else Counts + country.Pool.Cells[I][Squares]
+
+        #Number the infected neighbors of each infectee in order, and pick one of them at random
+        Cumulative = np.cumsum(Total, axis = 1)
+        Chosen = (self.rng.random(len(Infectees))*Cumulative[:, -1]).astype(np.int64)
+
+        Square = np.minimum((Cumulative <= Chosen[:, None]).sum(axis = 1), Squares.shape[1] - 1)
+        Within = Chosen - (Cumulative[Rows, Square] - Total[Rows, Square])
+
+        #Those chosen past the people indexed on their square were chosen from the Pool
+        Infectors = np.full(len(Infectees), -1, dtype = np.int64)
+        Tracked = Within < Counts[Rows, Square]
+        Infectors[Tracked] = People.ID[Index.People[Starts[Rows, Square][Tracked] + Within[Tracked]]]
+
+        return Infectors
+
+
+    def _Write_Count(self):
+        #Replace the JSON file in one step, so a reader never sees it half written
+        Temp = self.path + '.json.tmp'
+        with open(Temp, 'w') as f:
+            json.dump({'edges': self.Edges.size}, f)
+
+        os.replace(Temp, self.path + '.json')
+
+
+    def Flush(self):
+        '''Write everything recorded so far to disk, along with the number of infections recorded, so that a
+            TransmissionReader opened now reads exactly those.'''
+
+        self.Edges.Flush()
+        self._Write_Count()
+
+
+    def Close(self):
+        '''Finish writing the file.'''
+
+        self.Edges.Close()
+        self._Write_Count()
+##############################################################################################################
+##############################################################################################################
+##############################################################################################################
+
+
+
+
+##############################################################################################################
+##############################################################################################################
+##############################################################################################################
+class TransmissionReader:
+
+    def __init__(self, path):
+        '''Open the file path written by a TransmissionWriter. The attributes t, Infector, and Infectee are arrays with one
+            entry per infection, in the order they happened. If the writer has not been closed, these are the infections
+            written when it was last flushed.'''
+
+        with open(path + '.json') as f:
+            nEdges = json.load(f)['edges']
+
+        if nEdges > 0:
+            Edges = np.memmap(path, dtype = np.int64, mode = 'r', shape = (nEdges, 3))
+        else:
+            Edges = np.zeros((0, 3), dtype = np.int64)
+
+        self.t, self.Infector, self.Infectee = Edges.T
+
+
+    def __len__(self):
+        return len(self.t)
+
+
+    def Secondary_Cases(self):
+        '''Returns the IDs of everyone who infected someone else, and the number of people each of them infected, in order
+            of ID. Infections passed on from the Pool are left out.'''
+
+        Infector = np.asarray(self.Infector)
+
+        return np.unique(Infector[Infector >= 0], return_counts = True)
+##############################################################################################################
+##############################################################################################################
+##############################################################################################################
+
+
+
+
+if __name__ == '__main__':
+
+    #The worst-case scenario, with a million people in a larger country
+    def Build():
+        country = Country(N = 4500, seed = 0)
+        country.Add_Population(1000000, 'S', MoveType = 'Random')
+        country.Add_Population(20, 'I', MoveType = 'Random')
+
+        return Simulation(country, radius = 1, risk = 0.10, Infected_Iters = 100)
+
+    Iters = 300
+
+    Sim = Build()
+    Start = perf_counter()
+    Sim.Run_Headless(Iters)
+    Time = perf_counter() - Start
+
+    Sim = Build()
+    with TransmissionWriter('WorstCaseScenario_Transmissions.bin', seed = 0) as Writer:
+        Sim.country.provenance = Writer
+
+        Start = perf_counter()
+        Sim.Run_Headless(Iters)
+        Recorded = perf_counter() - Start
+
+    Tree = TransmissionReader('WorstCaseScenario_Transmissions.bin')
+    IDs, Cases = Tree.Secondary_Cases()
+
+    print(f'{Iters} iterations of a million people: {Time:.2f} s, or {Recorded:.2f} s recording provenance ({100*(Recorded/Time - 1):.1f}% more)')
+    print(f'Recorded {len(Tree)} infections')
+    print('Most infections passed on:')
+    for k in np.argsort(Cases, kind = 'stable')[::-1][:5]:
+        print(f'    person {IDs[k]} infected {Cases[k]}')
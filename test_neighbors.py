@@ -0,0 +1,79 @@
+'''Tests of the Moore Neighborhood sums in InfectiousDisease.py against a brute-force reference, which adds up a copy of
+    the grid rolled to every offset in the (2r+1)x(2r+1) window. Run them with pytest.
+'''
+
+import numpy as np
+import pytest
+
+from InfectiousDisease import Country, Moore_Sum, Window_Sum, I
+
+
+def Brute_Moore_Sum(Grid, radius):
+    #Every square receives the value of every square within radius rows and columns of it, wrapping around the edges
+    Total = np.zeros(Grid.shape, dtype = np.int64)
+
+    for dr in range(-radius, radius + 1):
+        for dc in range(-radius, radius + 1):
+            Total += np.roll(Grid, (dr, dc), axis = (0, 1))
+
+    return Total
+
+
+SIZES = [1, 2, 3, 5, 8, 13, 21, 34, 50]
+RADII = [0, 1, 2, 3, 4, 5, 40]
+
+
+@pytest.mark.parametrize('N', SIZES)
+@pytest.mark.parametrize('radius', RADII)
+def test_Moore_Sum_matches_brute_force(N, radius):
+    rng = np.random.default_rng([N, radius])
+    Grid = rng.integers(0, 4, (N, N))
+
+    assert np.array_equal(Moore_Sum(Grid, radius), Brute_Moore_Sum(Grid, radius))
+
+
+@pytest.mark.parametrize('N', [1, 4, 7, 50])
+@pytest.mark.parametrize('radius', [0, 1, 3, 5, 40])
+def test_GetInfectedNeighbors_matches_brute_force(N, radius):
+    country = Country(N = N, seed = [N, radius])
+    country.Add_Population(3*N*N, 'S', MoveType = 'Drunkard')
+    country.Add_Population(N*N, 'I', MoveType = 'Drunkard')
+
+    People = country.People
+    Infected = People.State == I
+    Grid = np.zeros((N, N), dtype = np.int64)
+    np.add.at(Grid, (People.Row[Infected], People.Col[Infected]), 1)
+
+    assert np.array_equal(country.GetInfectedNeighbors(radius), Brute_Moore_Sum(Grid, radius))
+
+
+@pytest.mark.parametrize('N, radius', [(10, 0), (10, 1), (10, 2), (10, 4), (50, 5), (12, 3)])
+def test_single_corner_cell_lights_the_wrapped_block(N, radius):
+    Grid = np.zeros((N, N), dtype = np.int64)
+    Grid[0, 0] = 1
+
+    #The (2r+1)x(2r+1) block centered on the corner, wrapped onto the far rows and columns
+    Near = (np.arange(N) <= radius) | (np.arange(N) >= N - radius)
+    Expected = (Near[:, None] & Near[None, :]).astype(np.int64)
+
+    Result = Moore_Sum(Grid, radius)
+
+    assert np.array_equal(Result, Expected)
+    assert Result.sum() == (2*radius + 1)**2
+
+
+def test_wide_window_counts_every_wrapped_copy():
+    #A window wider than the grid wraps around more than once, so each square is counted once per copy in the window
+    Grid = np.ones((3, 3), dtype = np.int64)
+
+    assert np.array_equal(Moore_Sum(Grid, 4), np.full((3, 3), 81))
+
+
+def test_Window_Sum_without_wrap_uses_the_edges_as_halo():
+    rng = np.random.default_rng(0)
+    Grid = rng.integers(0, 5, (12, 7))
+    radius = 2
+
+    Expected = np.array([Grid[i - radius:i + radius + 1].sum(axis = 0) for i in range(radius, 12 - radius)]).T
+
+    assert np.array_equal(Window_Sum(Grid, radius, wrap = False), Expected)